@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright (C) [2022] [Joseph Zakar], [observing@gmail.com]
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+"""
+Times Tabgen on generated shapes of increasing size and writes the results as JSON,
+so that runs from different commits can be compared with --compare.
+"""
+
+import io
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import platform
+import subprocess
+
+import inkex
+import tabgen
+
+# Each generator returns the elements of a drawing for about n edges in total.
+# An element is a list of closed subpaths, and a subpath a list of (x, y) vertices.
+# Shapes are sized so that edges are a few mm long, like a real template
+
+def ngon(n, rng):
+    # One regular polygon
+    r = 5.0*n/(2.0*math.pi)
+    return [[[(r*math.cos(2.0*math.pi*k/n), r*math.sin(2.0*math.pi*k/n)) for k in range(n)]]]
+
+def star(n, rng):
+    # One star polygon whose points have random lengths and spacing
+    n = max(4, n - n % 2)
+    r = 5.0*n/(2.0*math.pi)
+    pts = []
+    for k in range(n):
+        a = 2.0*math.pi*(k + rng.uniform(-0.3, 0.3))/n
+        rk = r if k % 2 == 0 else r - rng.uniform(1.0, 5.0)
+        pts.append((rk*math.cos(a), rk*math.sin(a)))
+    return [[pts]]
+
+def cutouts(n, rng):
+    # One square with rows of square holes in it
+    holes = max(1, (n - 4)//4)
+    side = int(math.ceil(math.sqrt(holes)))
+    outer = 10.0*side + 10.0
+    subpaths = [[(0.0, 0.0), (outer, 0.0), (outer, outer), (0.0, outer)]]
+    for h in range(holes):
+        x = 10.0 + 10.0*(h % side)
+        y = 10.0 + 10.0*(h // side)
+        subpaths.append([(x, y), (x, y+5.0), (x+5.0, y+5.0), (x+5.0, y)])
+    return [subpaths]
+
+def grid(n, rng):
+    # Rows of separate squares, one element each
+    squares = max(1, n//4)
+    side = int(math.ceil(math.sqrt(squares)))
+    elements = []
+    for s in range(squares):
+        x = 15.0*(s % side)
+        y = 15.0*(s // side)
+        elements.append([[(x, y), (x+10.0, y), (x+10.0, y+10.0), (x, y+10.0)]])
+    return elements
+
+def degenerate(n, rng):
+    # A polygon whose every other edge is a hundred thousandth of a mm long
+    n = max(6, n - n % 2)
+    r = 5.0*n/(2.0*math.pi)
+    pts = []
+    for k in range(n//2):
+        a = 4.0*math.pi*k/n
+        x, y = r*math.cos(a), r*math.sin(a)
+        pts.append((x, y))
+        pts.append((x - 1e-5*math.sin(a), y + 1e-5*math.cos(a)))
+    return [[pts]]
+
+SHAPES = {'ngon': ngon, 'star': star, 'cutouts': cutouts, 'grid': grid, 'degenerate': degenerate}
+BENCHES = ['effect', 'makeTab', 'makescore', 'checkForTab', 'insidePath', 'pointsInPath']
+TABHEIGHT = 2.0 # mm
+TABANGLE = 45.0
+DASHLENGTH = 0.5 # mm
+
+def svgDocument(elements):
+    body = []
+    for en, subpaths in enumerate(elements):
+        d = ' '.join('M ' + ' L '.join('{:g},{:g}'.format(x, y) for (x, y) in sub) + ' Z' for sub in subpaths)
+        body.append('<path id="p{0}" d="{1}" style="fill:none;stroke:#000000;stroke-width:0.25"/>'.format(en, d))
+    return ('<svg xmlns="http://www.w3.org/2000/svg" xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape"'
+            ' width="1000mm" height="1000mm" viewBox="0 0 1000 1000">'
+            '<g id="layer1" inkscape:groupmode="layer">' + ''.join(body) + '</g></svg>').encode()
+
+def tabgenArgs(elements):
+    return ['--unit=mm', '--tabheight={:g}'.format(TABHEIGHT), '--tabangle={:g}'.format(TABANGLE),\
+            '--dashlength={:g}'.format(DASHLENGTH), '--jobs=1'] + ['--id=p'+str(en) for en in range(len(elements))]
+
+def timeEffect(elements, repeat):
+    # Times Tabgen.effect() on a freshly loaded document each time
+    document = svgDocument(elements)
+    times = []
+    for run in range(repeat):
+        ext = tabgen.Tabgen()
+        ext.parse_arguments(tabgenArgs(elements))
+        ext.options.input_file = io.BytesIO(document)
+        ext.load_raw()
+        start = time.perf_counter()
+        ext.effect()
+        times.append(time.perf_counter() - start)
+    return times, sum(len(sub) for subpaths in elements for sub in subpaths)
+
+def allPieces(ext, elements):
+    # The pathStructs of each element, nested and oriented as buildPiece would have them
+    pieces = []
+    for subpaths in elements:
+        npaths = []
+        for sub in subpaths:
+            npath = tabgen.pathStruct()
+            npath.path = [tabgen.vec2(x, y) for (x, y) in sub] + [tabgen.vec2(sub[0][0], sub[0][1])]
+            npath.buildCoords()
+            npaths.append(npath)
+        ext.preparePiece(npaths)
+        pieces.append(npaths)
+    return pieces
+
+def edges(npaths):
+    return [(apath, apath.path[k], apath.path[k+1]) for apath in npaths for k in range(len(apath.path)-1)]
+
+def timeCalls(call, repeat):
+    times = []
+    for run in range(repeat):
+        start = time.perf_counter()
+        items = call()
+        times.append(time.perf_counter() - start)
+    return times, items
+
+def timeFunction(name, elements, repeat, rng):
+    # Times one of Tabgen's inner functions over the edges (or sample points) of every
+    # element. Returns the times and the number of edges or points in each
+    ext = tabgen.Tabgen()
+    ext.parse_arguments(tabgenArgs(elements))
+    pieces = allPieces(ext, elements)
+    segs = [seg for npaths in pieces for seg in edges(npaths)]
+    if name == 'makeTab':
+        return timeCalls(lambda: len([ext.makeTab(apath, pt1, pt2, TABHEIGHT, TABANGLE) for (apath, pt1, pt2) in segs]), repeat)
+    if name == 'makescore':
+        return timeCalls(lambda: len([ext.makescore(pt1, pt2, DASHLENGTH) for (apath, pt1, pt2) in segs]), repeat)
+    if name == 'checkForTab':
+        tablist = tabgen.tabIndex()
+        for (apath, pt1, pt2) in segs[::2]:
+            tablist.add(pt1, pt2)
+        return timeCalls(lambda: len([ext.checkForTab(pt1, pt2, tablist, False) for (apath, pt1, pt2) in segs]), repeat)
+    # The point tests cost a pass over every edge of a path per point, so use a fixed
+    # sample spread over the pieces, and at least one point in each
+    samples = [(npaths[0], []) for npaths in pieces]
+    for k in range(max(200, len(pieces))):
+        outer, pts = samples[k % len(samples)]
+        minX, minY, maxX, maxY = outer.bbox
+        pts.append(tabgen.vec2(rng.uniform(minX, maxX), rng.uniform(minY, maxY)))
+    if name == 'insidePath':
+        return timeCalls(lambda: len([ext.insidePath(outer, p) for (outer, pts) in samples for p in pts]), repeat)
+    return timeCalls(lambda: sum(len(ext.pointsInPath(outer, pts)) for (outer, pts) in samples), repeat)
+
+def gitCommit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),\
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True).stdout.strip()
+    except OSError:
+        return ''
+
+def compare(old, new):
+    # Lists the time of each benchmark in new against the same one in old, on stderr
+    # so that it doesn't get mixed up with the JSON. Only runs over the same number
+    # of items are compared
+    before = {(r['shape'], r['edges'], r['bench'], r.get('items')): r['best'] for r in old['results']}
+    sys.stderr.write("{0:<11} {1:>7} {2:<13} {3:>10} {4:>10} {5:>7}\n".format('shape', 'edges', 'bench', 'old s', 'new s', 'ratio'))
+    for r in new['results']:
+        key = (r['shape'], r['edges'], r['bench'], r['items'])
+        if key in before:
+            ratio = r['best']/before[key] if before[key] > 0 else float('inf')
+            sys.stderr.write("{0:<11} {1:>7} {2:<13} {3:>10.4f} {4:>10.4f} {5:>7.2f}\n".format(key[0], key[1], key[2], before[key], r['best'], ratio))
+
+def main(args):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--shapes", default=','.join(SHAPES),\
+        help="Comma separated shapes to generate (default: %(default)s)")
+    parser.add_argument("--benches", default=','.join(BENCHES),\
+        help="Comma separated things to time (default: %(default)s)")
+    parser.add_argument("--sizes", default="10,100,1000,10000,100000",\
+        help="Comma separated numbers of edges (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=3,\
+        help="Times to run each benchmark; the fastest counts (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for the random shapes")
+    parser.add_argument("--output", help="File to write the JSON results to (default: standard output)")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare with")
+    opts = parser.parse_args(args)
+    numpy = tabgen.loadNumpy()
+    report = {'meta': {'commit': gitCommit(), 'python': platform.python_version(), 'platform': platform.platform(),\
+                       'inkex': getattr(inkex, '__version__', ''), 'numpy': numpy.__version__ if numpy else None,\
+                       'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'repeat': opts.repeat, 'seed': opts.seed},\
+              'results': []}
+    for shape in opts.shapes.split(','):
+        for size in [int(s) for s in opts.sizes.split(',')]:
+            rng = random.Random(opts.seed)
+            elements = SHAPES[shape](size, rng)
+            nedges = sum(len(sub) for subpaths in elements for sub in subpaths)
+            for bench in opts.benches.split(','):
+                if bench == 'effect':
+                    times, items = timeEffect(elements, opts.repeat)
+                else:
+                    times, items = timeFunction(bench, elements, opts.repeat, rng)
+                report['results'].append({'shape': shape, 'edges': nedges, 'bench': bench, 'items': items,\
+                                          'best': min(times), 'times': times})
+                sys.stderr.write("{0:<11} {1:>7} {2:<13} {3:.4f} s\n".format(shape, nedges, bench, min(times)))
+    if opts.output:
+        with open(opts.output, 'w') as out:
+            json.dump(report, out, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        sys.stdout.write('\n')
+    if opts.compare:
+        with open(opts.compare) as old:
+            compare(json.load(old), report)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright (C) [2022] [Joseph Zakar], [observing@gmail.com]
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+"""
+Checks how long a fresh Python takes to import tabgen, using "python -X importtime".
+Exits with status 1 if the time spent on tabgen itself, leaving out inkex (which
+Inkscape needs anyway), goes over the budget, or if a module that tabgen should only
+load when it is needed was imported.
+"""
+
+import os
+import sys
+import argparse
+import subprocess
+
+# Only some runs need these, so importing tabgen must not load them
+LAZY = ['sqlite3', 'json', 'hashlib', 'glob', 'socket', 'concurrent.futures']
+
+def importTimes(module):
+    # Runs "import module" in a fresh interpreter and returns the cumulative import
+    # time in microseconds of each module it loaded, and which LAZY modules it loaded
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None) # time loading the .pyc, as Inkscape would
+    code = 'import sys, {0}; print(" ".join(m for m in {1!r} if m in sys.modules))'.format(module, LAZY)
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=here, env=env,\
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = {}
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.split('|')
+        if (len(fields) == 3) and fields[1].strip().isdigit():
+            name = fields[2].strip()
+            times[name] = times.get(name, 0) + int(fields[1])
+    return times, proc.stdout.split()
+
+def main(args):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--budget", type=float, default=10.0,\
+        help="Milliseconds allowed for importing tabgen, not counting inkex (default: %(default)s)")
+    parser.add_argument("--total-budget", type=float, default=0.0,\
+        help="Milliseconds allowed for the whole import, inkex included (default: no limit)")
+    parser.add_argument("--runs", type=int, default=5,\
+        help="Number of imports to time; the fastest counts (default: %(default)s)")
+    opts = parser.parse_args(args)
+    importTimes('tabgen') # writes the .pyc files if they are missing
+    own = total = None
+    for run in range(opts.runs):
+        times, loaded = importTimes('tabgen')
+        rtotal = times['tabgen'] / 1000.0
+        rown = (times['tabgen'] - times.get('inkex', 0)) / 1000.0
+        own = rown if own is None else min(own, rown)
+        total = rtotal if total is None else min(total, rtotal)
+    print("import tabgen: {0:.1f} ms, of which {1:.1f} ms outside inkex (budget {2:g} ms)".format(total, own, opts.budget))
+    failed = False
+    if own > opts.budget:
+        print("Over budget by {0:.1f} ms".format(own - opts.budget))
+        failed = True
+    if (opts.total_budget > 0) and (total > opts.total_budget):
+        print("Whole import over budget by {0:.1f} ms".format(total - opts.total_budget))
+        failed = True
+    if len(loaded) > 0:
+        print("Imported too early: " + ', '.join(loaded))
+        failed = True
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
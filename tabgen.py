@@ -24,23 +24,52 @@ tabs and score lines for each straight edge marked by line paths of a specific c
 
 import inkex
 import math
-import copy
-import inspect
+import sys
+import os
+import argparse
+import contextlib
+import functools
+import io
+import time
+from array import array
 
-from inkex import PathElement, Style
-from inkex.paths import Move, Line, ZoneClose, Path
-from inkex.elements._groups import Group
-from inkex.transforms import Vector2d
+from inkex import PathElement, Style, Group, Transform, Vector2d
+
+# Inkscape starts a new Python for every run, so modules that only some runs need
+# (the cache, --jobs, batch and server modes, NumPy) are imported where they are used.
+# check_importtime.py keeps an eye on the cost of importing this file
+
+@functools.lru_cache(maxsize=None)
+def loadNumpy():
+    # Returns the numpy module, or None if it isn't installed
+    try:
+        import numpy
+    except ImportError: # Not bundled with every Inkscape install, so it's optional
+        return None
+    return numpy
 
 class pathStruct(object):
     def __init__(self):
         self.id="path0000"
-        self.path=Path()
+        self.path=[] # vertices as vec2, first and last equal if closed
         self.enclosed=False
         self.tabmarker=False
         self.style = None
+        self.winding=0 # sign of the signed area; 0 if not yet known or degenerate
+        self.coords=None # flat x,y array of the vertices, built once the path is complete
+        self.bbox=None # (minX, minY, maxX, maxY) of coords
+        self.depth=0 # number of paths this one is nested inside
+        self.nested=False # True once depth, enclosed and winding have been worked out
     def __str__(self):
         return self.path
+    def buildCoords(self):
+        self.coords=array('d')
+        for pt in self.path:
+            self.coords.append(pt.x)
+            self.coords.append(pt.y)
+        xs=self.coords[0::2]
+        ys=self.coords[1::2]
+        self.bbox=(min(xs),min(ys),max(xs),max(ys))
     
 class pnPoint(object):
    # This class came from https://github.com/JoJocoder/PNPOLY
@@ -48,29 +77,317 @@ class pnPoint(object):
         self.p=p
     def __str__(self):
         return self.p
-    def InPolygon(self,polygon,BoundCheck=False):
-        inside=False
-        if BoundCheck:
-            minX=polygon[0][0]
-            maxX=polygon[0][0]
-            minY=polygon[0][1]
-            maxY=polygon[0][1]
-            for p in polygon:
-                minX=min(p[0],minX)
-                maxX=max(p[0],maxX)
-                minY=min(p[1],minY)
-                maxY=max(p[1],maxY)
-            if self.p[0]<minX or self.p[0]>maxX or self.p[1]<minY or self.p[1]>maxY:
+    def InCoords(self,coords,bbox=None):
+        # Even-odd test of the point against a polygon given as a flat x,y array,
+        # with a precomputed bounding box to rule out points well outside it
+        x=self.p[0]
+        y=self.p[1]
+        if bbox is not None:
+            if x<bbox[0] or x>bbox[2] or y<bbox[1] or y>bbox[3]:
                 return False
-        j=len(polygon)-1
-        for i in range(len(polygon)):
-            if ((polygon[i][1]>self.p[1])!=(polygon[j][1]>self.p[1]) and (self.p[0]<(polygon[j][0]-polygon[i][0])*(self.p[1]-polygon[i][1])/( polygon[j][1] - polygon[i][1] ) + polygon[i][0])):
-                    inside =not inside
-            j=i
+        inside=False
+        n=len(coords)
+        xj=coords[n-2]
+        yj=coords[n-1]
+        for i in range(0,n,2):
+            xi=coords[i]
+            yi=coords[i+1]
+            if ((yi>y)!=(yj>y)) and (x<(xj-xi)*(y-yi)/(yj-yi)+xi):
+                inside=not inside
+            xj=xi
+            yj=yi
         return inside
 
+class vec2(object):
+    # Lightweight 2-D point/vector for the tab geometry
+    __slots__=('x','y')
+    def __init__(self,x,y):
+        self.x=x
+        self.y=y
+
+@functools.lru_cache(maxsize=4096)
+def flattenCubic(x1, y1, x2, y2, x3, y3, tol):
+    # Flattens the cubic Bezier curve from (0,0) with control points (x1,y1), (x2,y2)
+    # and end (x3,y3) into a polyline that stays within tol of it. Returns the polyline's
+    # vertices after the start, as a tuple of (x, y). Curves are given relative to their
+    # start point, so repeats of the same segment anywhere in a drawing are only worked
+    # out once
+    points = []
+    stack = [((0.0, 0.0), (x1, y1), (x2, y2), (x3, y3), 0)]
+    while stack:
+        p0, p1, p2, p3, depth = stack.pop()
+        # The curve lies within 3/4 of the control points' distance from the chord
+        cx = p3[0] - p0[0]
+        cy = p3[1] - p0[1]
+        chord = math.hypot(cx, cy)
+        if chord > tol*1e-3:
+            dev = max(abs((p1[0]-p0[0])*cy - (p1[1]-p0[1])*cx), abs((p2[0]-p0[0])*cy - (p2[1]-p0[1])*cx))/chord
+        else: # closed loop, so measure from the start instead
+            dev = max(math.hypot(p1[0]-p0[0], p1[1]-p0[1]), math.hypot(p2[0]-p0[0], p2[1]-p0[1]))
+        if (0.75*dev <= tol) or (depth >= 16):
+            points.append(p3)
+            continue
+        # Split it in half (de Casteljau); the second half goes on the stack first
+        # so that the first is flattened first
+        q0 = ((p0[0]+p1[0])/2.0, (p0[1]+p1[1])/2.0)
+        q1 = ((p1[0]+p2[0])/2.0, (p1[1]+p2[1])/2.0)
+        q2 = ((p2[0]+p3[0])/2.0, (p2[1]+p3[1])/2.0)
+        r0 = ((q0[0]+q1[0])/2.0, (q0[1]+q1[1])/2.0)
+        r1 = ((q1[0]+q2[0])/2.0, (q1[1]+q2[1])/2.0)
+        mid = ((r0[0]+r1[0])/2.0, (r0[1]+r1[1])/2.0)
+        stack.append((mid, r1, q2, p3, depth+1))
+        stack.append((p0, q0, r0, mid, depth+1))
+    return tuple(points)
+
+@functools.lru_cache(maxsize=None)
+def sourceHash():
+    # Hash of this file. Results saved by a different version of it don't count
+    import hashlib
+    with open(__file__, 'rb') as src:
+        return hashlib.sha256(src.read()).digest()
+
+class tabIndex(object):
+    # Spatial hash of tab marker segments. Each segment is filed under the grid
+    # cell of both of its endpoints, so a lookup only has to look at the cells
+    # around one endpoint instead of walking every marker segment.
+    def __init__(self, tol=0.001):
+        self.tol=tol
+        self.cells={}
+        self.count=0
+    def __len__(self):
+        return self.count
+    def cell(self,x,y):
+        return (math.floor(x/self.tol),math.floor(y/self.tol))
+    def add(self,pt1,pt2):
+        seg=((pt1.x,pt1.y),(pt2.x,pt2.y))
+        self.cells.setdefault(self.cell(pt1.x,pt1.y),[]).append(seg)
+        c2=self.cell(pt2.x,pt2.y)
+        if c2 != self.cell(pt1.x,pt1.y):
+            self.cells.setdefault(c2,[]).append(seg)
+        self.count+=1
+    def contains(self,pt1,pt2):
+        # Same matching rules as the old linear scan: both endpoints within tol,
+        # in either direction
+        tol=self.tol
+        cx,cy=self.cell(pt1.x,pt1.y)
+        for i in (cx-1,cx,cx+1):
+            for j in (cy-1,cy,cy+1):
+                for (a,b) in self.cells.get((i,j),()):
+                    if math.isclose(pt1.x,a[0],abs_tol=tol) and math.isclose(pt1.y,a[1],abs_tol=tol):
+                        if math.isclose(pt2.x,b[0],abs_tol=tol) and math.isclose(pt2.y,b[1],abs_tol=tol):
+                            return True
+                    if math.isclose(pt1.x,b[0],abs_tol=tol) and math.isclose(pt1.y,b[1],abs_tol=tol):
+                        if math.isclose(pt2.x,a[0],abs_tol=tol) and math.isclose(pt2.y,a[1],abs_tol=tol):
+                            return True
+        return False
+
+class segmentGrid(object):
+    # Uniform grid of the tabs and edges of a piece. Each item is filed under every
+    # cell its bounding box touches, so the items that might overlap a tab are
+    # found by looking at the few cells under it instead of at every item.
+    def __init__(self, size):
+        self.size=size
+        self.cells={}
+    def span(self,box):
+        s=self.size
+        return range(math.floor(box[0]/s),math.floor(box[2]/s)+1),range(math.floor(box[1]/s),math.floor(box[3]/s)+1)
+    def add(self,item,box):
+        xs,ys=self.span(box)
+        for i in xs:
+            for j in ys:
+                self.cells.setdefault((i,j),[]).append(item)
+    def near(self,box):
+        found=set()
+        xs,ys=self.span(box)
+        for i in xs:
+            for j in ys:
+                found.update(self.cells.get((i,j),()))
+        return found
+
+class styleCache(object):
+    # Parses each distinct style string once and remembers everything derived from
+    # it. Exported templates reuse a handful of styles across many paths, so
+    # nearly every lookup is a hit
+    def __init__(self):
+        self.parsed={}
+        self.derived={}
+    def tokens(self,sstr):
+        # The style as a tuple of its 'property:value' tokens
+        toks=self.parsed.get(sstr)
+        if toks is None:
+            toks=self.parsed[sstr]=tuple(sstr.split(';'))
+        return toks
+    def stroke(self,sstr):
+        # The style's stroke as inkex reads it, in lower case
+        key=('stroke',sstr)
+        if key not in self.derived:
+            self.derived[key]=str(Style(sstr).get('stroke','')).lower()
+        return self.derived[key]
+    def hasStroke(self,sstr,color):
+        # True if the style has a stroke of the given color
+        key=('hasStroke',sstr,color)
+        if key not in self.derived:
+            self.derived[key]=any(tok.startswith('stroke:') and tok.split(':')[1] == color for tok in self.tokens(sstr))
+        return self.derived[key]
+    def scaled(self,sstr,escale):
+        # The style with its stroke width and miter limit scaled by escale, and with
+        # stroke:none added if it has no stroke properties at all
+        key=('scaled',sstr,escale)
+        if key not in self.derived:
+            lsstr=list(self.tokens(sstr))
+            strokeflag=False
+            for stoken in range(len(lsstr)):
+                if lsstr[stoken].startswith('stroke-width') or lsstr[stoken].startswith('stroke-miterlimit'):
+                    swt=lsstr[stoken].split(':')[1]
+                    try:
+                        swf=str(float(swt)*escale)
+                        lsstr[stoken]=lsstr[stoken].replace(swt,swf)
+                    except ValueError:
+                        pass # value is expressed in units (e.g. px), so leave it
+                if lsstr[stoken].startswith('stroke'):
+                    strokeflag=True
+            if not strokeflag:
+                lsstr.append('stroke:none')
+            self.derived[key]=";".join(lsstr)
+        return self.derived[key]
+    def recolored(self,sstr,color):
+        # The style with its stroke color replaced by (or set to) color
+        key=('recolored',sstr,color)
+        if key not in self.derived:
+            lsstr=list(self.tokens(sstr))
+            strokeflag=False
+            for stoken in range(len(lsstr)):
+                if lsstr[stoken].startswith('stroke:'):
+                    swt=lsstr[stoken].split(':')[1]
+                    lsstr[stoken]=lsstr[stoken].replace(swt,color)
+                    strokeflag=True
+            if not strokeflag:
+                lsstr.append('stroke:'+color)
+            self.derived[key]=";".join(lsstr)
+        return self.derived[key]
+    def dashed(self,sstr,dashlength):
+        # The style with a dash pattern of dashlength space followed by dashlength mark
+        key=('dashed',sstr,dashlength)
+        if key not in self.derived:
+            dstyle=Style(sstr)
+            dstyle['stroke-dasharray']='{:g},{:g}'.format(dashlength, dashlength)
+            dstyle['stroke-dashoffset']='{:g}'.format(dashlength)
+            self.derived[key]=str(dstyle)
+        return self.derived[key]
+
+class resultCache(object):
+    # On-disk store of finished pieces (model path data and edges to score), keyed
+    # by a hash of everything that goes into them. Re-running after a small edit then
+    # only has to work out the pieces that changed
+    def __init__(self, path=None, maxentries=50000, timeout=30.0):
+        if path is None:
+            path = os.path.join(self.cacheDir(), 'pieces.sqlite')
+        import sqlite3
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.maxentries=maxentries
+        self.used=[] # keys of the pieces found, to mark as recently used
+        self.pending=[] # (key, value) of the pieces to store
+        # Other Tabgen processes (--batch --jobs) share the cache. Each write is a short
+        # transaction of its own, and with a write-ahead log readers don't wait for it
+        self.db=sqlite3.connect(path, timeout=timeout)
+        try:
+            self.db.execute('PRAGMA journal_mode=WAL')
+        except sqlite3.OperationalError: # locked, or the file system can't do it
+            pass
+        self.db.execute('CREATE TABLE IF NOT EXISTS pieces (key TEXT PRIMARY KEY, value TEXT, used REAL)')
+        self.salt=sourceHash()
+    @staticmethod
+    def cacheDir():
+        if os.name == 'nt':
+            base=os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+        else:
+            base=os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+        return os.path.join(base, 'tabgen')
+    def get(self, key):
+        # A cache that can't be read, such as one locked for too long, is a miss
+        import sqlite3
+        try:
+            row=self.db.execute('SELECT value FROM pieces WHERE key=?', (key,)).fetchone()
+        except sqlite3.OperationalError:
+            return None
+        if row is None:
+            return None
+        self.used.append(key)
+        import json
+        return json.loads(row[0])
+    def put(self, key, value):
+        import json
+        self.pending.append((key, json.dumps(value)))
+    def flush(self):
+        # Writes out what get and put have collected since the last flush. If the cache
+        # can't be written to, they're dropped: the run goes on without them
+        import sqlite3
+        now=time.time()
+        try:
+            self.db.executemany('UPDATE pieces SET used=? WHERE key=?', [(now, key) for key in self.used])
+            self.db.executemany('INSERT OR REPLACE INTO pieces VALUES (?,?,?)',\
+                                [(key, value, now) for (key, value) in self.pending])
+            self.db.commit()
+        except sqlite3.OperationalError:
+            self.db.rollback()
+        self.used=[]
+        self.pending=[]
+    def close(self):
+        import sqlite3
+        self.flush()
+        # Forget the least recently used pieces once there are too many
+        try:
+            self.db.execute('DELETE FROM pieces WHERE key NOT IN (SELECT key FROM pieces ORDER BY used DESC LIMIT ?)',\
+                            (self.maxentries,))
+            self.db.commit()
+        except sqlite3.OperationalError:
+            self.db.rollback()
+        self.db.close()
+
+class profiler(object):
+    # Wall time and number of calls of each stage of a run and of the hot methods,
+    # and counts of things done along the way. Only made when profiling is asked for,
+    # so a normal run pays nothing for it
+    def __init__(self):
+        self.started=time.perf_counter()
+        self.stages={} # name: [seconds, calls]
+        self.methods={}
+        self.counters={}
+    @contextlib.contextmanager
+    def stage(self, name):
+        entry=self.stages.setdefault(name,[0.0,0])
+        start=time.perf_counter()
+        try:
+            yield
+        finally:
+            entry[0]+=time.perf_counter()-start
+            entry[1]+=1
+    def count(self, name, n=1):
+        self.counters[name]=self.counters.get(name,0)+n
+    def wrap(self, obj, name, counter=None):
+        # Replaces method name of obj with one that is timed (including any methods it
+        # calls); counter(args, result) returns a list of (counter name, amount) to add
+        method=getattr(obj,name)
+        entry=self.methods.setdefault(name,[0.0,0])
+        def timed(*args):
+            start=time.perf_counter()
+            result=method(*args)
+            entry[0]+=time.perf_counter()-start
+            entry[1]+=1
+            if counter is not None:
+                for cname, amount in counter(args, result):
+                    self.count(cname, amount)
+            return result
+        setattr(obj,name,timed)
+    def report(self):
+        def table(entries):
+            return {name: {'seconds': secs, 'calls': calls} for name, (secs, calls) in entries.items()}
+        return {'total seconds': time.perf_counter()-self.started, 'stages': table(self.stages),\
+                'methods': table(self.methods), 'counters': dict(self.counters)}
+
 class Tabgen(inkex.EffectExtension):
-    
+    prof = None # a profiler, if --profile or TABGEN_PROFILE asked for one
+
     def add_arguments(self, pars):
         pars.add_argument("--usermenu")
         pars.add_argument("--tabangle", type=float, default=45.0,\
@@ -81,14 +398,117 @@ class Tabgen(inkex.EffectExtension):
             help="Length of dashline in dimentional units (zero for solid line)")
         pars.add_argument("--tabsets", default="both",\
             help="Tab placement on polygons with cutouts")
+        pars.add_argument("--scoremode", default="explode",\
+            help="Score line output: explode (one path segment per dash) or dasharray (solid lines dashed with stroke-dasharray)")
         pars.add_argument("--dashcolor", type=str, dest="dashcolor", default="#00ff00",\
             help="Color of scorelines when solid")
         pars.add_argument("--markercolor", type=str, dest="markercolor", default="#ff0000",\
             help="Color of lines for marking tabs")
         pars.add_argument("--tabmarker", type=inkex.Boolean, dest="tabmarker", default=False,\
             help="Check to put tabs where there are lines of above color; uncheck for opposite")
+        pars.add_argument("--tabside", default="winding",\
+            help="How to find the outside of an edge: winding (from polygon orientation) or probe (point-in-polygon tests)")
+        pars.add_argument("--flatness", type=float, default=0.01,\
+            help="How far (in dimensional units) curves may be from the straight edges they are turned into")
+        pars.add_argument("--fixoverlaps", type=inkex.Boolean, default=True,\
+            help="Shrink tabs that would overlap another tab or edge of the same piece")
+        pars.add_argument("--mergescores", type=inkex.Boolean, default=True,\
+            help="Score each line once: edges shared by two pieces once, and straight runs of edges as one line")
         pars.add_argument("--unit", default="in",\
             help="Dimensional units of selected paths")
+        pars.add_argument("--preview", type=inkex.Boolean, default=False,\
+            help="Fast live preview: reuse the geometry read in on the last run and draw score lines as dash styles")
+        pars.add_argument("--cache", type=inkex.Boolean, default=False,\
+            help="Keep finished pieces in an on-disk cache and reuse them when nothing about them has changed")
+        pars.add_argument("--jobs", type=int, default=1,\
+            help="Number of processes for the tab and score geometry (0 for one per CPU)")
+        pars.add_argument("--selectclass", default="",\
+            help="Also select paths with any of these (comma separated) classes")
+        pars.add_argument("--selectcolor", default="",\
+            help="Also select paths with any of these (comma separated) stroke colors")
+        pars.add_argument("--profile", default=os.environ.get('TABGEN_PROFILE', ''),\
+            help="Write the time taken by each stage and hot method as JSON to this file (- for stderr)")
+
+    def startProfile(self):
+        # Times the hot methods by replacing them on this object, so that nothing
+        # changes for them when profiling is off. Tab and score work done in --jobs
+        # worker processes only shows in the time of the build stage
+        self.prof = profiler()
+        for name in ('effect', 'selectPaths', 'readElement', 'preparePiece', 'nestPaths', 'buildPiece',\
+                     'makeTab', 'checkForTab', 'insidePath', 'pieceKey', 'scoreRuns'):
+            self.prof.wrap(self, name)
+        self.prof.wrap(self, 'fitTab', lambda args, res: [('tabs shrunk to fit', int(res != (args[1], args[2])))])
+        self.prof.wrap(self, 'shrinkOverlappingTabs', lambda args, res: [('tabs shrunk to clear overlaps', res)])
+        self.prof.wrap(self, 'wrongSide', lambda args, res: [('tabs flipped to the other side', int(res))])
+        self.prof.wrap(self, 'pointsInPath', lambda args, res: [('points tested against a path', len(res))])
+        self.prof.wrap(self, 'makescore', lambda args, res: [('dashes written', res.count('M'))])
+        self.prof.wrap(self, 'drawline', lambda args, res: [('elements written', 1)])
+
+    def stage(self, name):
+        # Context manager that times a stage of the run when profiling
+        if self.prof is None:
+            return contextlib.nullcontext()
+        return self.prof.stage(name)
+
+    def load_raw(self):
+        if self.options.profile != '':
+            self.startProfile()
+        with self.stage('load document'):
+            super().load_raw()
+
+    def save_raw(self, ret):
+        with self.stage('save document'):
+            super().save_raw(ret)
+
+    def clean_up(self):
+        super().clean_up()
+        if self.prof is not None:
+            import json
+            report = json.dumps(self.prof.report(), indent=1, sort_keys=True)
+            if self.options.profile == '-':
+                sys.stderr.write(report + '\n')
+            else:
+                with open(self.options.profile, 'w') as out:
+                    out.write(report + '\n')
+            self.prof = None
+
+    def composedTransform(self, node, cache):
+        # Returns the transform from node's coordinates to the document's, including
+        # those of all its parent groups. It's cached per node, so siblings share
+        # the work done for their parents
+        if node is None:
+            return Transform()
+        ctransform = cache.get(node)
+        if ctransform is None:
+            ctransform = self.composedTransform(node.getparent(), cache) @ node.transform
+            cache[node] = ctransform
+        return ctransform
+
+    def transformPaths(self, paths, transform):
+        # Applies transform to the vertices of all the pathStructs in paths
+        a, b, c, d, e, f = transform.a, transform.b, transform.c, transform.d, transform.e, transform.f
+        for apath in paths:
+            for pt in apath.path:
+                x = pt.x
+                pt.x = a*x + c*pt.y + e
+                pt.y = b*x + d*pt.y + f
+
+    def selectPaths(self, styles):
+        # Adds the paths picked out by --selectclass and --selectcolor to the selection.
+        # This is mostly for batch use, where there's nobody to select things by hand.
+        picked = []
+        for elem in self.svg.descendants().filter(PathElement):
+            if self.pickedBy(elem, styles):
+                elem.get_id() # make sure it has an id to be selected by
+                picked.append(elem)
+        self.svg.selection.add(*picked)
+
+    def pickedBy(self, elem, styles):
+        # True if --selectclass or --selectcolor picks out elem
+        classes = [c.strip() for c in self.options.selectclass.split(',') if c.strip() != '']
+        colors = [c.strip().lower() for c in self.options.selectcolor.split(',') if c.strip() != '']
+        return any(c in elem.classes for c in classes) or \
+               (styles.stroke(elem.attrib.get('style', '')) in colors)
 
     #draw SVG line segment(s) between the given (raw) points
     def drawline(self, dstr, name, parent, sstr=None):
@@ -102,486 +522,1081 @@ class Tabgen(inkex.EffectExtension):
         el.style = stylestr
         el.label = name
 
-    def pathInsidePath(self, path, testpath):
-        enclosed = True
-        for tp in testpath:
-            # If any point in the testpath is outside the path, it's not enclosed
-            if self.insidePath(path, tp) == False:
-                enclosed = False
-                return enclosed # True if testpath is fully enclosed in path
-        return enclosed
+    def nestPaths(self, npaths):
+        # Build the containment hierarchy of the subpaths in one pass: outer shells at
+        # depth 0, their holes at depth 1, islands inside the holes at depth 2, etc.
+        # A path with an odd depth is a cutout.
+        def bboxArea(apath):
+            return (apath.bbox[2]-apath.bbox[0])*(apath.bbox[3]-apath.bbox[1])
+        def bboxInside(outer, inner):
+            return outer[0] <= inner[0] and outer[1] <= inner[1] and outer[2] >= inner[2] and outer[3] >= inner[3]
+        roots = []
+        children = {}
+        # A path can only be inside one with a bigger bounding box, so visit those first
+        for apath in sorted(npaths, key=bboxArea, reverse=True):
+            siblings = roots
+            apath.depth = 0
+            found = True
+            while found:
+                # Walk down the tree. Nested paths don't cross, so a single vertex
+                # is enough to tell whether apath is inside a candidate
+                found = False
+                for cpath in siblings:
+                    if bboxInside(cpath.bbox, apath.bbox) and self.insidePath(cpath, apath.path[0]):
+                        apath.depth = cpath.depth + 1
+                        siblings = children[id(cpath)]
+                        found = True
+                        break
+            siblings.append(apath)
+            children[id(apath)] = []
+        for apath in npaths:
+            apath.enclosed = (apath.depth % 2 == 1)
+
+    def pointsInPath(self, tpath, pts):
+        # Batch version of insidePath. Returns a list with one bool per point in pts
+        if tpath.coords is None:
+            tpath.buildCoords()
+        numpy = loadNumpy()
+        if numpy is None:
+            return [pnPoint((p.x, p.y)).InCoords(tpath.coords, tpath.bbox) for p in pts]
+        px = numpy.fromiter((p.x for p in pts), dtype=float)
+        py = numpy.fromiter((p.y for p in pts), dtype=float)
+        result = numpy.zeros(len(px), dtype=bool)
+        minX, minY, maxX, maxY = tpath.bbox
+        inbox = numpy.nonzero((px >= minX) & (px <= maxX) & (py >= minY) & (py <= maxY))[0]
+        if len(inbox) == 0:
+            return result.tolist()
+        verts = numpy.frombuffer(tpath.coords, dtype=float).reshape(-1, 2)
+        xi = verts[:, 0]
+        yi = verts[:, 1]
+        xj = numpy.roll(xi, 1)
+        yj = numpy.roll(yi, 1)
+        # Work in chunks so the points x edges matrix stays a manageable size
+        chunk = max(1, 1000000 // len(xi))
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            for start in range(0, len(inbox), chunk):
+                idx = inbox[start:start+chunk]
+                x = px[idx, None]
+                y = py[idx, None]
+                crosses = ((yi > y) != (yj > y)) & (x < (xj-xi)*(y-yi)/(yj-yi) + xi)
+                result[idx] = (numpy.count_nonzero(crosses, axis=1) % 2) == 1
+        return result.tolist()
         
-    def insidePath(self, path, p):
+    def insidePath(self, tpath, p):
+        # tpath - a pathStruct; its vertex array and bounding box are reused across calls
+        if tpath.coords is None:
+            tpath.buildCoords()
         point = pnPoint((p.x, p.y))
-        pverts = []
-        for pnum in path:
-            if pnum.letter == 'Z':
-                pverts.append((path[0].x, path[0].y))
-            else:
-                pverts.append((pnum.x, pnum.y))
-        isInside = point.InPolygon(pverts, True)
+        isInside = point.InCoords(tpath.coords, tpath.bbox)
         return isInside # True if point p is inside path
 
+    def signedArea(self, path):
+        # Shoelace formula over the (closed) vertex list of path
+        area = 0.0
+        for i in range(len(path)-1):
+            area += path[i].x*path[i+1].y - path[i+1].x*path[i].y
+        area += path[-1].x*path[0].y - path[0].x*path[-1].y
+        return area/2.0
+
+    def wrongSide(self, tpath, pt1, pt2, pnpt1, pnpt2):
+        # Returns True if the probe tab (pnpt1,pnpt2) on edge pt1-pt2 sits on the side
+        # of the edge where the tab should not go
+        if (self.options.tabside == 'winding') and (tpath.winding != 0):
+            # The interior of a polygon with positive signed area lies on the positive
+            # side of the cross product of each edge with the offset from that edge
+            ox = (pnpt1.x + pnpt2.x - pt1.x - pt2.x)/2.0
+            oy = (pnpt1.y + pnpt2.y - pt1.y - pt2.y)/2.0
+            cross = (pt2.x - pt1.x)*oy - (pt2.y - pt1.y)*ox
+            inside = ((cross > 0.0) == (tpath.winding > 0))
+            return inside != tpath.enclosed
+        inside = self.pointsInPath(tpath, [pnpt1, pnpt2])
+        return ((not tpath.enclosed) and (inside[0] or inside[1])) or \
+               (tpath.enclosed and ((not inside[0]) and (not inside[1])))
+
     def makescore(self, pt1, pt2, dashlength):
         # Draws a dashed line of dashlength between two points
         # Dash = dashlength space followed by dashlength mark
         # if dashlength is zero, we want a solid line
-        # Returns dashed line as a Path object
-        apt1 = Line(0.0,0.0)
-        apt2 = Line(0.0,0.0)
-        ddash = Path()
+        # Returns dashed line as path data (a string)
         if math.isclose(dashlength, 0.0):
             #inkex.utils.debug("Draw solid dashline")
-            ddash.append(Move(pt1.x,pt1.y))
-            ddash.append(Line(pt2.x,pt2.y))
-        else:
-            if math.isclose(pt1.y, pt2.y):
-                #inkex.utils.debug("Draw horizontal dashline")
-                if pt1.x < pt2.x:
-                    xcushion = pt2.x - dashlength
-                    xpt = pt1.x
-                    ypt = pt1.y
-                else:
-                    xcushion = pt1.x - dashlength
-                    xpt = pt2.x
-                    ypt = pt2.y
-                done = False
-                while not(done):
-                    if (xpt + dashlength*2) <= xcushion:
-                        xpt = xpt + dashlength
-                        ddash.append(Move(xpt,ypt))
-                        xpt = xpt + dashlength
-                        ddash.append(Line(xpt,ypt))
-                    else:
-                        done = True
-            elif math.isclose(pt1.x, pt2.x):
-                #inkex.utils.debug("Draw vertical dashline")
-                if pt1.y < pt2.y:
-                    ycushion = pt2.y - dashlength
-                    xpt = pt1.x
-                    ypt = pt1.y
-                else:
-                    ycushion = pt1.y - dashlength
-                    xpt = pt2.x
-                    ypt = pt2.y
-                done = False
-                while not(done):
-                    if(ypt + dashlength*2) <= ycushion:
-                        ypt = ypt + dashlength         
-                        ddash.append(Move(xpt,ypt))
-                        ypt = ypt + dashlength
-                        ddash.append(Line(xpt,ypt))
-                    else:
-                        done = True
-            else:
-                #inkex.utils.debug("Draw sloping dashline")
-                if pt1.y > pt2.y:
-                    apt1.x = pt1.x
-                    apt1.y = pt1.y
-                    apt2.x = pt2.x
-                    apt2.y = pt2.y
-                else:
-                    apt1.x = pt2.x
-                    apt1.y = pt2.y
-                    apt2.x = pt1.x
-                    apt2.y = pt1.y
-                m = (apt1.y-apt2.y)/(apt1.x-apt2.x)
-                theta = math.atan(m)
-                msign = (m>0) - (m<0)
-                ycushion = apt2.y + dashlength*math.sin(theta)
-                xcushion = apt2.x + msign*dashlength*math.cos(theta)
-                xpt = apt1.x
-                ypt = apt1.y
-                done = False
-                while not(done):
-                    nypt = ypt - dashlength*2*math.sin(theta)
-                    nxpt = xpt - msign*dashlength*2*math.cos(theta)
-                    if (nypt >= ycushion) and (((m<0) and (nxpt <= xcushion)) or ((m>0) and (nxpt >= xcushion))):
-                        # move to end of space / beginning of mark
-                        xpt = xpt - msign*dashlength*math.cos(theta)
-                        ypt = ypt - msign*dashlength*math.sin(theta)
-                        ddash.append(Move(xpt,ypt))
-                        # draw the mark
-                        xpt = xpt - msign*dashlength*math.cos(theta)
-                        ypt = ypt - msign*dashlength*math.sin(theta)
-                        ddash.append(Line(xpt,ypt))
-                    else:
-                        done = True
-        return ddash
-
-    def detectIntersect(self, x1, y1, x2, y2, x3, y3, x4, y4):
-        td = (x1-x2)*(y3-y4)-(y1-y2)*(x3-x4)
-        if td == 0:
-            # These line segments are parallel
-            return False
-        t = ((x1-x3)*(y3-y4)-(y1-y3)*(x3-x4))/td
-        if (0.0 <= t) and (t <= 1.0):
-            return True
+            return 'M {:g} {:g} L {:g} {:g}'.format(pt1.x, pt1.y, pt2.x, pt2.y)
+        # Dashes start from the left end of a horizontal line, the top end of a
+        # vertical line and the bottom end of a sloping line
+        if math.isclose(pt1.y, pt2.y):
+            flip = pt2.x < pt1.x
+        elif math.isclose(pt1.x, pt2.x):
+            flip = pt2.y < pt1.y
         else:
-            return False
+            flip = pt2.y > pt1.y
+        if flip:
+            pt1, pt2 = pt2, pt1
+        seglength = math.sqrt((pt1.x-pt2.x)**2 +(pt1.y-pt2.y)**2)
+        # Dash k runs from (2k+1) to (2k+2) dashlengths along the line, and is only
+        # drawn if there's at least one more dashlength of line left after it
+        ndash = int(math.floor((seglength/dashlength - 1.0)/2.0 + 1e-9))
+        if ndash <= 0:
+            return ''
+        dx = (pt2.x - pt1.x)*dashlength/seglength
+        dy = (pt2.y - pt1.y)*dashlength/seglength
+        return ' '.join(['M {:g} {:g} L {:g} {:g}'.format(pt1.x + dx*(2*k+1), pt1.y + dy*(2*k+1),
+                                                         pt1.x + dx*(2*k+2), pt1.y + dy*(2*k+2)) for k in range(ndash)])
 
-    def orientTab(self,pt1,pt2,height,angle,theta,orient):
-        tpt1 = Line(0.0,0.0)
-        tpt2 = Line(0.0,0.0)
-        tpt1.x = pt1.x + orient[0]*height + orient[1]*height/math.tan(math.radians(angle))
-        tpt2.x = pt2.x + orient[2]*height + orient[3]*height/math.tan(math.radians(angle))
-        tpt1.y = pt1.y + orient[4]*height + orient[5]*height/math.tan(math.radians(angle))
-        tpt2.y = pt2.y + orient[6]*height + orient[7]*height/math.tan(math.radians(angle))
-        if not math.isclose(theta, 0.0):
-            t11 = Path([Move(pt1.x,pt1.y),Line(tpt1.x, tpt1.y)])
-            t12 = Path([Move(pt1.x,pt1.y),Line(tpt2.x, tpt2.y)])
-            thetal1 = t11.rotate(theta, [pt1.x,pt1.y])
-            thetal2 = t12.rotate(theta, [pt2.x,pt2.y])
-            tpt1.x = thetal1[1].x
-            tpt1.y = thetal1[1].y
-            tpt2.x = thetal2[1].x
-            tpt2.y = thetal2[1].y
+    def orientTab(self, pt1, pt2, height, cot, u, n):
+        # pt1, pt2 - the edge; u - its unit direction; n - the unit normal on the tab side
+        # cot - 1/tan of the tab angle
+        # returns the two tab points as vec2, in order of closest to pt1
+        inset = height*cot
+        tpt1 = vec2(pt1.x + u.x*inset + n.x*height, pt1.y + u.y*inset + n.y*height)
+        tpt2 = vec2(pt2.x - u.x*inset + n.x*height, pt2.y - u.y*inset + n.y*height)
         return tpt1,tpt2
 
+    def fitTab(self, seglength, tabht, taba):
+        # Returns the (height, angle) of the tab closest to the requested one whose
+        # sides don't cross on an edge of length seglength.
+        # The sides of a tab meet at a height of seglength*tan(angle)/2, so the tab
+        # is valid when it is lower than that. As before, we first try a steeper
+        # angle (up to 88 degrees), then a lower tab at the requested angle.
+        # Either way, the top of the tab is kept 0.1% of the edge wide.
+        if math.isclose(seglength, 0.0):
+            return tabht, taba # Nothing will fit. Just show the failure
+        if taba >= 90.0:
+            return tabht, taba # A rectangle, whose sides never cross
+        if tabht < seglength*math.tan(math.radians(taba))/2.0:
+            return tabht, taba # It already fits
+        angle = math.degrees(math.atan(2.0*tabht/(seglength*0.999)))
+        if angle <= 88.0:
+            return tabht, max(angle, taba)
+        return seglength*0.999*math.tan(math.radians(taba))/2.0, taba
+
     def makeTab(self, tpath, pt1, pt2, tabht, taba):
         # tpath - the pathstructure containing pt1 and pt2
         # pt1, pt2 - the two points where the tab will be inserted
         # tabht - the height of the tab
         # taba - the angle of the tab sides
-        # returns the two tab points (Line objects) in order of closest to pt1
-        tpt1 = Line(0.0,0.0)
-        tpt2 = Line(0.0,0.0)
-        currTabHt = tabht
-        currTabAngle = taba
-        testAngle = 1.0
-        testHt = currTabHt * 0.001
-        adjustTab = 0
-        tabDone = False
-        while not tabDone:
-            # Let's find out the orientation of the tab
-            if math.isclose(pt1.x, pt2.x):
-                # It's vertical. Let's try the right side
-                if pt1.y < pt2.y:
-                    pnpt1,pnpt2 = self.orientTab(pt1,pt2,testHt,testAngle,0.0,[1,0,1,0,0,1,0,-1])
-                    if ((not tpath.enclosed) and (self.insidePath(tpath.path, pnpt1) or self.insidePath(tpath.path, pnpt2))) or \
-                       (tpath.enclosed and ((not self.insidePath(tpath.path, pnpt1)) and (not self.insidePath(tpath.path, pnpt2)))):
-                        tpt1,tpt2 = self.orientTab(pt1,pt2,currTabHt,currTabAngle,0.0,[-1,0,-1,0,0,1,0,-1]) # Guessed wrong
-                    else:
-                        tpt1,tpt2 = self.orientTab(pt1,pt2,currTabHt,currTabAngle,0.0,[1,0,1,0,0,1,0,-1]) # Guessed right
-                else: # pt2.y < pt1.y
-                    pnpt1,pnpt2 = self.orientTab(pt1,pt2,testHt,testAngle,0.0,[1,0,1,0,0,-1,0,1])
-                    if ((not tpath.enclosed) and (self.insidePath(tpath.path, pnpt1) or self.insidePath(tpath.path, pnpt2))) or \
-                       (tpath.enclosed and ((not self.insidePath(tpath.path, pnpt1)) and (not self.insidePath(tpath.path, pnpt2)))):
-                        tpt1,tpt2 = self.orientTab(pt1,pt2,currTabHt,currTabAngle,0.0,[-1,0,-1,0,0,-1,0,1]) # Guessed wrong
-                    else:
-                        tpt1,tpt2 = self.orientTab(pt1,pt2,currTabHt,currTabAngle,0.0,[1,0,1,0,0,-1,0,1]) # Guessed right
-            elif math.isclose(pt1.y, pt2.y):
-                # It's horizontal. Let's try the top
-                if pt1.x < pt2.x:
-                    pnpt1,pnpt2 = self.orientTab(pt1,pt2,testHt,testAngle,0.0,[0,1,0,-1,-1,0,-1,0])
-                    if ((not tpath.enclosed) and (self.insidePath(tpath.path, pnpt1) or self.insidePath(tpath.path, pnpt2))) or \
-                       (tpath.enclosed and ((not self.insidePath(tpath.path, pnpt1)) and (not self.insidePath(tpath.path, pnpt2)))):
-                        tpt1,tpt2 = self.orientTab(pt1,pt2,currTabHt,currTabAngle,0.0,[0,1,0,-1,1,0,1,0]) # Guessed wrong
-                    else:
-                        tpt1,tpt2 = self.orientTab(pt1,pt2,currTabHt,currTabAngle,0.0,[0,1,0,-1,-1,0,-1,0]) # Guessed right
-                else: # pt2.x < pt1.x
-                    pnpt1,pnpt2 = self.orientTab(pt1,pt2,testHt,testAngle,0.0,[0,-1,0,1,-1,0,-1,0])
-                    if ((not tpath.enclosed) and (self.insidePath(tpath.path, pnpt1) or self.insidePath(tpath.path, pnpt2))) or \
-                       (tpath.enclosed and ((not self.insidePath(tpath.path, pnpt1)) and (not self.insidePath(tpath.path, pnpt2)))):
-                        tpt1,tpt2 = self.orientTab(pt1,pt2,currTabHt,currTabAngle,0.0,[0,-1,0,1,1,0,1,0]) # Guessed wrong
-                    else:
-                        tpt1,tpt2 = self.orientTab(pt1,pt2,currTabHt,currTabAngle,0.0,[0,-1,0,1,-1,0,-1,0]) # Guessed right
-
-            else: # the orientation is neither horizontal nor vertical
-                # Let's get the slope of the line between the points
-                # Because Inkscape's origin is in the upper-left corner,
-                # a positive slope (/) will yield a negative value
-                slope = (pt2.y - pt1.y)/(pt2.x - pt1.x)
-                # Let's get the angle to the horizontal
-                theta = math.degrees(math.atan(slope))
-                # Let's construct a horizontal tab
-                seglength = math.sqrt((pt1.x-pt2.x)**2 +(pt1.y-pt2.y)**2)
-                if slope < 0.0:
-                    if pt1.x < pt2.x:
-                        pnpt1,pnpt2 = self.orientTab(pt1,pt2,testHt,testAngle,theta,[0,1,0,-1,-1,0,-1,0])
-                        if ((not tpath.enclosed) and (self.insidePath(tpath.path, pnpt1) or self.insidePath(tpath.path, pnpt2))) or \
-                           (tpath.enclosed and ((not self.insidePath(tpath.path, pnpt1)) and (not self.insidePath(tpath.path, pnpt2)))):
-                            tpt1,tpt2 = self.orientTab(pt1,pt2,currTabHt,currTabAngle,theta,[0,1,0,-1,1,0,1,0]) # Guessed wrong
-                        else:
-                            tpt1,tpt2 = self.orientTab(pt1,pt2,currTabHt,currTabAngle,theta,[0,1,0,-1,-1,0,-1,0]) # Guessed right
-                    else: # pt1.x > pt2.x
-                        pnpt1,pnpt2 = self.orientTab(pt1,pt2,testHt,testAngle,theta,[0,-1,0,1,-1,0,-1,0])
-                        if ((not tpath.enclosed) and (self.insidePath(tpath.path, pnpt1) or self.insidePath(tpath.path, pnpt2))) or \
-                           (tpath.enclosed and ((not self.insidePath(tpath.path, pnpt1)) and (not self.insidePath(tpath.path, pnpt2)))):
-                            tpt1,tpt2 = self.orientTab(pt1,pt2,currTabHt,currTabAngle,theta,[0,-1,0,1,1,0,1,0]) # Guessed wrong
-                        else:
-                            tpt1,tpt2 = self.orientTab(pt1,pt2,currTabHt,currTabAngle,theta,[0,-1,0,1,-1,0,-1,0]) # Guessed right
-                else: # slope > 0.0
-                    if pt1.x < pt2.x:
-                        pnpt1,pnpt2 = self.orientTab(pt1,pt2,testHt,testAngle,theta,[0,1,0,-1,-1,0,-1,0])
-                        if ((not tpath.enclosed) and (self.insidePath(tpath.path, pnpt1) or self.insidePath(tpath.path, pnpt2))) or \
-                           (tpath.enclosed and ((not self.insidePath(tpath.path, pnpt1)) and (not self.insidePath(tpath.path, pnpt2)))):
-                            tpt1,tpt2 = self.orientTab(pt1,pt2,currTabHt,currTabAngle,theta,[0,1,0,-1,1,0,1,0]) # Guessed wrong
-                        else:
-                            tpt1,tpt2 = self.orientTab(pt1,pt2,currTabHt,currTabAngle,theta,[0,1,0,-1,-1,0,-1,0]) # Guessed right
-                    else: # pt1.x > pt2.x
-                        pnpt1,pnpt2 = self.orientTab(pt1,pt2,testHt,testAngle,theta,[0,-1,0,+1,-1,0,-1,0])
-                        if ((not tpath.enclosed) and (self.insidePath(tpath.path, pnpt1) or self.insidePath(tpath.path, pnpt2))) or \
-                           (tpath.enclosed and ((not self.insidePath(tpath.path, pnpt1)) and (not self.insidePath(tpath.path, pnpt2)))):
-                            tpt1,tpt2 = self.orientTab(pt1,pt2,currTabHt,currTabAngle,theta,[0,-1,0,1,1,0,1,0]) # Guessed wrong
-                        else:
-                            tpt1,tpt2 = self.orientTab(pt1,pt2,currTabHt,currTabAngle,theta,[0,-1,0,1,-1,0,-1,0]) # Guessed right
-            # Check to see if any tabs intersect each other
-            if self.detectIntersect(pt1.x, pt1.y, tpt1.x, tpt1.y, pt2.x, pt2.y, tpt2.x, tpt2.y):
-                # Found an intersection.
-                if adjustTab == 0:
-                    # Try increasing the tab angle in one-degree increments
-                    currTabAngle = currTabAngle + 1.0
-                    if currTabAngle > 88.0: # We're not increasing the tab angle above 89 degrees
-                        adjustTab = 1
-                        currTabAngle = taba
-                if adjustTab == 1:
-                    # So, try reducing the tab height in 20% increments instead
-                    currTabHt = currTabHt - tabht*0.2 # Could this lead to a zero tab_height?
-                    if currTabHt <= 0.0:
-                        # Give up
-                        currTabHt = tabht
-                        adjustTab = 2
-                if adjustTab == 2:
-                    tabDone = True # Just show the failure
-            else:
-                tabDone = True
-            
+        # returns the two tab points (vec2) in order of closest to pt1
+        # Shrink the tab, if necessary, so its sides don't cross
+        seglength = math.sqrt((pt1.x-pt2.x)**2 +(pt1.y-pt2.y)**2)
+        if math.isclose(seglength, 0.0):
+            return vec2(pt1.x,pt1.y), vec2(pt2.x,pt2.y) # No room for a tab
+        currTabHt, currTabAngle = self.fitTab(seglength, tabht, taba)
+        # The edge direction and its normal form the rotation from a horizontal tab
+        # to this edge, so all of the geometry is a few multiply-adds
+        u = vec2((pt2.x - pt1.x)/seglength, (pt2.y - pt1.y)/seglength)
+        n = vec2(u.y, -u.x) # Let's try the left side (the top, for a left-to-right edge)
+        # Make a tiny test tab and see if it's on the wrong side of the edge
+        testHt = tabht * 0.001
+        pnpt1,pnpt2 = self.orientTab(pt1,pt2,testHt,1.0/math.tan(math.radians(1.0)),u,n)
+        if self.wrongSide(tpath, pt1, pt2, pnpt1, pnpt2):
+            n = vec2(-n.x, -n.y) # Guessed wrong
+        tpt1,tpt2 = self.orientTab(pt1,pt2,currTabHt,1.0/math.tan(math.radians(currTabAngle)),u,n)
         return tpt1,tpt2
 
     def checkForTab(self, pt1, pt2, tablist, marker):
         # if marker is true, we want to return true if we find the pts in the tablist
-        for tabpts in tablist:
-            if math.isclose(pt1.x,tabpts[0].x,abs_tol=0.001) and math.isclose(pt1.y,tabpts[0].y,abs_tol=0.001):
-                if math.isclose(pt2.x,tabpts[1].x,abs_tol=0.001) and math.isclose(pt2.y,tabpts[1].y,abs_tol=0.001):
-                    return marker
-            if math.isclose(pt1.x,tabpts[1].x,abs_tol=0.001) and math.isclose(pt1.y,tabpts[1].y,abs_tol=0.001):
-                if math.isclose(pt2.x,tabpts[0].x,abs_tol=0.001) and math.isclose(pt2.y,tabpts[0].y,abs_tol=0.001):
-                    return marker
+        # tablist is a tabIndex, so this is a hash lookup rather than a scan
+        if tablist.contains(pt1, pt2):
+            return marker
         return (not marker)
+
+    def segmentsCross(self, ax, ay, bx, by, cx, cy, dx, dy, eps):
+        # True if segments ab and cd cross at a point inside both. Segments that
+        # only touch, like the sides of two tabs meeting at a vertex, don't count
+        d1 = (bx-ax)*(cy-ay) - (by-ay)*(cx-ax)
+        d2 = (bx-ax)*(dy-ay) - (by-ay)*(dx-ax)
+        if not (((d1 > eps) and (d2 < -eps)) or ((d1 < -eps) and (d2 > eps))):
+            return False
+        d3 = (dx-cx)*(ay-cy) - (dy-cy)*(ax-cx)
+        d4 = (dx-cx)*(by-cy) - (dy-cy)*(bx-cx)
+        return ((d3 > eps) and (d4 < -eps)) or ((d3 < -eps) and (d4 > eps))
+
+    def insideTab(self, q, x, y, eps):
+        # True if (x,y) is inside the tab outline q, and not just on it
+        # q - flat x,y list of edge point 1, tab point 1, tab point 2, edge point 2
+        area = 0.0
+        for k in range(0, 8, 2):
+            area += q[k]*q[(k+3)%8] - q[(k+2)%8]*q[k+1]
+        if area == 0.0:
+            return False
+        for k in range(0, 8, 2):
+            ex, ey = q[(k+2)%8]-q[k], q[(k+3)%8]-q[k+1]
+            if (ex == 0.0) and (ey == 0.0):
+                continue # tab points that meet
+            side = ex*(y-q[k+1]) - ey*(x-q[k])
+            if (side if area > 0.0 else -side) <= eps:
+                return False
+        return True
+
+    def tabHits(self, q, other, eps):
+        # True if the tab outline q overlaps other, which is another tab outline
+        # or, with two points, an edge of the piece
+        for k in (0, 2, 4):
+            for j in range(0, len(other)-2, 2):
+                if self.segmentsCross(q[k],q[k+1],q[k+2],q[k+3],other[j],other[j+1],other[j+2],other[j+3],eps):
+                    return True
+        for j in range(0, len(other), 2):
+            if self.insideTab(q, other[j], other[j+1], eps):
+                return True
+        if len(other) == 8:
+            return self.insideTab(other, q[2], q[3], eps) or self.insideTab(other, q[4], q[5], eps)
+        return False
+
+    def cornerRoom(self, vertex, u, n, nbr, nbrtab):
+        # Steepest angle from the edge leaving vertex in direction u that a tab side
+        # on the n side can lean at without running into the neighbouring edge from
+        # vertex to nbr, or None if that edge isn't on the tab's side. When the
+        # neighbouring edge's tab (nbrtab, its tab point at vertex) is on the same
+        # side too, the two share the room
+        wx, wy = nbr.x - vertex.x, nbr.y - vertex.y
+        room = math.atan2(wx*n.x + wy*n.y, wx*u.x + wy*u.y)
+        if ((wx == 0.0) and (wy == 0.0)) or (room <= 0.0):
+            return None
+        if (nbrtab is not None) and ((nbrtab.x - vertex.x)*n.x + (nbrtab.y - vertex.y)*n.y > 0.0):
+            room = room/2.0
+        return room
+
+    def shrinkOverlappingTabs(self, npaths, tabs):
+        # Shrinks the tabs of a piece that would overlap another of its tabs or
+        # edges, such as those of the two edges of a sharp inside corner, or a tab
+        # reaching across a cutout. tabs maps (subpath number, edge number) to the
+        # tab points from makeTab, and is updated. Returns the number shrunk.
+        # Two tabs meeting at a corner overlap however low they are, so there the
+        # tab sides are first leaned in, at a shallower angle to their edge, until
+        # they clear each other. Each tab is then checked against the tabs and
+        # edges near it, found with a segmentGrid, and halved in height until it
+        # is clear
+        def outline(shape):
+            pt1, pt2, u, n, ht, inset1, inset2 = shape
+            return (pt1.x, pt1.y, pt1.x + u.x*inset1 + n.x*ht, pt1.y + u.y*inset1 + n.y*ht,\
+                    pt2.x - u.x*inset2 + n.x*ht, pt2.y - u.y*inset2 + n.y*ht, pt2.x, pt2.y)
+        def bounds(q):
+            return (min(q[0::2]), min(q[1::2]), max(q[0::2]), max(q[1::2]))
+        shapes = {}
+        shrunk = set()
+        for (pn, ptn), (tpt1, tpt2) in tabs.items():
+            path = npaths[pn].path
+            pt1, pt2 = path[ptn], path[ptn+1]
+            seglength = math.sqrt((pt2.x-pt1.x)**2 + (pt2.y-pt1.y)**2)
+            if math.isclose(seglength, 0.0):
+                continue
+            u = vec2((pt2.x - pt1.x)/seglength, (pt2.y - pt1.y)/seglength)
+            ht = (tpt1.x - pt1.x)*u.y - (tpt1.y - pt1.y)*u.x
+            if ht == 0.0:
+                continue
+            n = vec2(u.y, -u.x) if ht > 0.0 else vec2(-u.y, u.x)
+            shape = [pt1, pt2, u, n, abs(ht), (tpt1.x - pt1.x)*u.x + (tpt1.y - pt1.y)*u.y,\
+                     (pt2.x - tpt2.x)*u.x + (pt2.y - tpt2.y)*u.y]
+            last = len(path) - 1
+            if last > 2:
+                prev, nxt = (ptn - 1) % last, (ptn + 1) % last
+                room1 = self.cornerRoom(pt1, u, n, path[prev], tabs[(pn, prev)][1] if (pn, prev) in tabs else None)
+                room2 = self.cornerRoom(pt2, vec2(-u.x, -u.y), n, path[nxt+1], tabs[(pn, nxt)][0] if (pn, nxt) in tabs else None)
+                # Sides that only meet the neighbour along a line, like the 45 degree
+                # tabs at a square corner, are left alone
+                if (room1 is not None) and (math.atan2(shape[4], shape[5]) > room1 + 1e-9):
+                    shape[5] = shape[4]/math.tan(room1*0.999)
+                    shrunk.add((pn, ptn))
+                if (room2 is not None) and (math.atan2(shape[4], shape[6]) > room2 + 1e-9):
+                    shape[6] = shape[4]/math.tan(room2*0.999)
+                    shrunk.add((pn, ptn))
+                if shape[5] + shape[6] > seglength*0.999:
+                    # Shallower sides cross lower down, so lower the tab to where they don't
+                    scale = seglength*0.999/(shape[5] + shape[6])
+                    shape[4:7] = [shape[4]*scale, shape[5]*scale, shape[6]*scale]
+            shapes[(pn, ptn)] = shape
+        if len(shapes) == 0:
+            return 0
+        outlines = {key: outline(shape) for key, shape in shapes.items()}
+        boxes = {key: bounds(q) for key, q in outlines.items()}
+        edges = []
+        first = [] # index in edges of each subpath's first edge
+        total = 0.0
+        for apath in npaths:
+            first.append(len(edges))
+            c = apath.coords
+            for k in range(0, len(c)-2, 2):
+                edges.append((c[k], c[k+1], c[k+2], c[k+3]))
+                total += math.sqrt((c[k+2]-c[k])**2 + (c[k+3]-c[k+1])**2)
+        # Cells as big as a tab is high or an edge is long on average, whichever is
+        # more, keep the number of cells each item is filed under and found near small
+        size = max(max(shape[4] for shape in shapes.values()), total/max(len(edges), 1))
+        if size <= 0.0:
+            return len(shrunk)
+        eps = (size*1e-4)**2
+        grid = segmentGrid(size)
+        edgeboxes = [(min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)) for (x1, y1, x2, y2) in edges]
+        for k, box in enumerate(edgeboxes):
+            grid.add(k, box)
+        # Tabs only ever get smaller, so they stay filed under their first bounding box
+        for key, box in boxes.items():
+            grid.add(key, box)
+        for key, shape in shapes.items():
+            # The corners were sorted out above, so a tab can't overlap its own edge
+            # or the edges and tabs either side of it
+            pn, ptn = key
+            last = len(npaths[pn].path) - 1
+            if last > 2:
+                prev, nxt = (ptn - 1) % last, (ptn + 1) % last
+                skip = {key, (pn, prev), (pn, nxt), first[pn] + ptn, first[pn] + prev, first[pn] + nxt}
+            else:
+                skip = {key, first[pn] + ptn}
+            near = [item for item in grid.near(boxes[key]) if item not in skip]
+            for tries in range(20):
+                q = outlines[key]
+                qb = bounds(q)
+                hit = None
+                for item in near:
+                    b = boxes[item] if isinstance(item, tuple) else edgeboxes[item]
+                    if (b[0] > qb[2]) or (b[2] < qb[0]) or (b[1] > qb[3]) or (b[3] < qb[1]):
+                        continue # too far apart to touch
+                    if self.tabHits(q, outlines[item] if isinstance(item, tuple) else edges[item], eps):
+                        hit = item
+                        break
+                if hit is None:
+                    break
+                # Of two tabs in each other's way, lower the taller one, so that
+                # they end up sharing the room between them
+                lower = hit if isinstance(hit, tuple) and (shapes[hit][4] > shape[4]) else key
+                shapes[lower][4:7] = [x/2.0 for x in shapes[lower][4:7]]
+                outlines[lower] = outline(shapes[lower])
+                shrunk.add(lower)
+        for key in shrunk:
+            q = outlines[key]
+            tabs[key] = [vec2(q[2], q[3]), vec2(q[4], q[5])]
+        return len(shrunk)
                     
                     
-    def effect(self):
-        scale = self.svg.unittouu('1'+self.options.unit)
-        layer = self.svg.get_current_layer()
-        tab_angle = float(self.options.tabangle)
-        tab_height = float(self.options.tabheight) * scale
-        dashlength = float(self.options.dashlength) * scale
-        tabmarker = self.options.tabmarker
-        markercolor = str(self.options.markercolor)
-        dashcolor = str(self.options.dashcolor)
-        tabsets = self.options.tabsets
-        tablist = [] # contains pairs of points to put (or not put) tabs
+    def flattenSegment(self, ptoken, x0, y0, lastctrl, tol):
+        # Turns a curve command (absolute C, S, Q, T or A) starting at (x0,y0) into
+        # straight edges that stay within tol of it
+        # lastctrl - (letter, x, y) of the control point of the previous command,
+        #            for S and T to reflect, or None if it wasn't a curve
+        # Returns the vertices after (x0,y0), and the lastctrl for the next command
+        args = ptoken.args
+        letter = ptoken.letter
+        if letter == 'A':
+            curves = [tuple(c.args) for c in ptoken.to_curves(Vector2d(x0, y0))]
+            ctrl = None
+        elif letter in 'CS':
+            if letter == 'C':
+                x1, y1, x2, y2, x3, y3 = args
+            else:
+                x2, y2, x3, y3 = args
+                x1, y1 = x0, y0
+                if (lastctrl != None) and (lastctrl[0] == 'C'):
+                    x1, y1 = 2*x0 - lastctrl[1], 2*y0 - lastctrl[2]
+            curves = [(x1, y1, x2, y2, x3, y3)]
+            ctrl = ('C', x2, y2)
+        else:
+            if letter == 'Q':
+                qx, qy, x3, y3 = args
+            else:
+                x3, y3 = args
+                qx, qy = x0, y0
+                if (lastctrl != None) and (lastctrl[0] == 'Q'):
+                    qx, qy = 2*x0 - lastctrl[1], 2*y0 - lastctrl[2]
+            # The same curve as a cubic
+            curves = [(x0 + 2.0*(qx-x0)/3.0, y0 + 2.0*(qy-y0)/3.0, x3 + 2.0*(qx-x3)/3.0, y3 + 2.0*(qy-y3)/3.0, x3, y3)]
+            ctrl = ('Q', qx, qy)
+        points = []
+        for (x1, y1, x2, y2, x3, y3) in curves:
+            for (px, py) in flattenCubic(x1-x0, y1-y0, x2-x0, y2-y0, x3-x0, y3-y0, tol):
+                points.append((x0+px, y0+py))
+            points[-1] = (x3, y3) # exactly, so a closing point matches the start
+            x0, y0 = x3, y3
+        return points, ctrl
+
+    def readElement(self, elem, etransform, styles, markercolor, flatness):
+        # Reads a path element into pathStructs, in the coordinates given by etransform
+        # flatness - how far curves may be from the edges they become, in those coordinates
+        # Returns the closed paths and the tab markers as two lists
         npaths = []
-        savid = ''
-        elems = []
-        pc = 0
+        markers = []
+        # Curves are flattened in the path's own coordinates, before the transform
+        tol = flatness
+        if etransform:
+            tol = flatness / max(math.sqrt(abs(etransform.a*etransform.d - etransform.b*etransform.c)), 1e-12)
         sstr = None
-        for selem in self.svg.selection.filter(PathElement):
-            copyflag = False
-            if 'style' in selem.attrib:
-                lsstr = selem.attrib['style'].split(';')
-                for stoken in range(len(lsstr)):
-                    if lsstr[stoken].startswith('stroke:'):
-                        swt = lsstr[stoken].split(':')[1]
-                        if swt == markercolor:
-                            # stroke is markercolor. move element to the front of the list
-                            elems.insert(0,copy.deepcopy(selem))
-                            selem.delete() # and get rid of the original
-                        else:
-                            elems.append(copy.deepcopy(selem))
-                        copyflag = True
-            else: # no style property; just copy it
-                elems.append(copy.deepcopy(selem))
-                copyflag = True
-            if not copyflag:
-                elems.append(copy.deepcopy(selem))  
-        if len(elems) == 0:
-            raise inkex.AbortExtension("Nothing selected")
-        for elem in elems:
-            escale = 1.0
-            npaths.clear()
-            if 'transform' in elem.attrib:
-                transforms = elem.attrib['transform'].split()
-                for tf in transforms:
-                    if tf.startswith('scale'):
-                        escale = float(tf.split('(')[1].split(')')[0])
-                if 'style' in elem.attrib:
-                    lsstr = elem.attrib['style'].split(';')
-                    strokeflag = False
-                    for stoken in range(len(lsstr)):
-                        if lsstr[stoken].startswith('stroke-width'):
-                            swt = lsstr[stoken].split(':')[1]
-                            if not swt[2:].isalpha(): # is value expressed in units (e.g. px)?
-                                swf = str(float(swt)*escale) # no. scale it
-                                lsstr[stoken] = lsstr[stoken].replace(swt, swf)
-                        if lsstr[stoken].startswith('stroke-miterlimit'):
-                            swt = lsstr[stoken].split(':')[1]
-                            if not swt[2:].isalpha(): # is value expressed in units (e.g. px)?
-                                swf = str(float(swt)*escale) # no. scale it
-                                lsstr[stoken] = lsstr[stoken].replace(swt, swf)
-                        if lsstr[stoken].startswith('stroke'):
-                            strokeflag = True
-                    if not strokeflag:
-                        lsstr.append('stroke:none')
-                    sstr = ";".join(lsstr)
-                else:
-                    sstr = None
-                elem.apply_transform()
-            last_letter = 'Z'
-            savid = elem.get_id()
-            idmod = 0
-            for ptoken in elem.path.to_absolute(): # For each point in the path
-                if ptoken.letter == 'M': # Starting point
-                    # Hold this point in case we receive a Z
-                    ptx1 = mx = ptoken.x
-                    pty1 = my = ptoken.y
-                    '''
-                    Assign a structure to the new path. We assume that there is
-                    only one path and, therefore, it isn't enclosed by another
-                    path. However, we'll suffix the ID, if we find a
-                    sub-path.
-                    '''
-                    npath = pathStruct()
-                    npath.enclosed = False
-                    if sstr == None:
-                        if 'style' in elem.attrib:
-                            lsstr = elem.attrib['style'].split(';')
-                            for stoken in range(len(lsstr)):
-                                if lsstr[stoken].startswith('stroke:'):
-                                    swt = lsstr[stoken].split(':')[1]
-                                    if swt == markercolor:
-                                        # stroke is markercolor. This is tab marker
-                                        npath.tabmarker = True
-                            npath.style = elem.attrib['style']
-                    else:
-                        npath.style = sstr
-                    if not npath.tabmarker: # tabmarkers don't get an id
-                        if idmod > 0:
-                            npath.id = elem.get_id()+"-"+str(idmod)
-                        else:
-                            npath.id = elem.get_id()
-                        idmod += 1
-                    npath.path.append(Move(ptx1,pty1))
-                elif npath != None: # This condition is part of a workaround described further down
-                    if last_letter != 'M':
-                        ptx1 = ptx2
-                        pty1 = pty2
-                    if ptoken.letter == 'L':
-                        ptx2 = ptoken.x
-                        pty2 = ptoken.y
-                    elif ptoken.letter == 'H':
-                        ptx2 = ptoken.x
-                        pty2 = pty1
-                    elif ptoken.letter == 'V':
-                        ptx2 = ptx1
-                        pty2 = ptoken.y
-                    elif ptoken.letter == 'Z':
-                        ptx2 = mx
-                        pty2 = my
+        if 'style' in elem.attrib:
+            sstr = elem.attrib['style']
+        ismarker = (sstr != None) and styles.hasStroke(sstr, markercolor)
+        if etransform and (sstr != None):
+            # Scale the stroke by the transform's change in area
+            escale = math.sqrt(abs(etransform.a*etransform.d - etransform.b*etransform.c))
+            sstr = styles.scaled(sstr, escale)
+        # The path is read in its own coordinates; the transform is applied to the
+        # vertices once they've all been read in
+        epath = elem.path.to_absolute()
+        last_letter = 'Z'
+        lastctrl = None
+        idmod = 0
+        npath = None # Nothing read yet, e.g. for an empty path
+        for ptoken in epath: # For each point in the path
+            if ptoken.letter == 'M': # Starting point
+                # Hold this point in case we receive a Z
+                ptx1 = mx = ptoken.x
+                pty1 = my = ptoken.y
+                '''
+                Assign a structure to the new path. We assume that there is
+                only one path and, therefore, it isn't enclosed by another
+                path. However, we'll suffix the ID, if we find a
+                sub-path.
+                '''
+                npath = pathStruct()
+                npath.enclosed = False
+                npath.tabmarker = ismarker # stroke is markercolor. This is tab marker
+                npath.style = sstr
+                if not npath.tabmarker: # tabmarkers don't get an id
+                    if idmod > 0:
+                        npath.id = elem.get_id()+"-"+str(idmod)
                     else:
-                        raise inkex.AbortExtension("Unrecognized path command {0}".format(ptoken.letter))
-                    npath.path.append(Line(ptx2,pty2))
-                    if ptoken.letter == 'Z' or ((ptx2 == mx) and (pty2 == my)):
-                        if npath.style != None:
-                            if npath.tabmarker:
-                                # add its points to tab list
-                                    for npts in range(len(npath.path)-1):
-                                        tablist.append([npath.path[npts], npath.path[npts+1]])
-                                    # don't need this path anymore so delete it
-                                    elem.delete()
-                                    npath = None
-                            else:
-                                npaths.append(npath)
-                                npath = None
+                        npath.id = elem.get_id()
+                    idmod += 1
+                npath.path.append(vec2(ptx1,pty1))
+            elif npath != None: # This condition is part of a workaround described further down
+                if last_letter != 'M':
+                    ptx1 = ptx2
+                    pty1 = pty2
+                if ptoken.letter == 'L':
+                    ptx2 = ptoken.x
+                    pty2 = ptoken.y
+                elif ptoken.letter == 'H':
+                    ptx2 = ptoken.x
+                    pty2 = pty1
+                elif ptoken.letter == 'V':
+                    ptx2 = ptx1
+                    pty2 = ptoken.y
+                elif ptoken.letter == 'Z':
+                    ptx2 = mx
+                    pty2 = my
+                elif ptoken.letter in 'CSQTA':
+                    points, lastctrl = self.flattenSegment(ptoken, ptx1, pty1, lastctrl, tol)
+                    for (px, py) in points[:-1]:
+                        npath.path.append(vec2(px,py))
+                    ptx2, pty2 = points[-1]
+                else:
+                    raise inkex.AbortExtension("Unrecognized path command {0}".format(ptoken.letter))
+                npath.path.append(vec2(ptx2,pty2))
+                if ptoken.letter == 'Z' or ((ptx2 == mx) and (pty2 == my)):
+                    if npath.style != None:
+                        if npath.tabmarker:
+                            markers.append(npath)
+                            npath = None
                         else:
                             npaths.append(npath)
                             npath = None
+                    else:
+                        npaths.append(npath)
+                        npath = None
+            else:
+                # We could have ended up here if the original input path's last point was equal to
+                # its first point and the next path command was a 'z'. This is a workaround for
+                # what I think is an improperly closed path.
+                pass
+            last_letter = ptoken.letter
+            if last_letter not in 'CSQTA':
+                lastctrl = None
+        # finished reading in the path
+        if npath != None: # Was this path not closed?
+            if npath.style != None:
+                if npath.tabmarker:
+                    markers.append(npath)
+                    npath = None
                 else:
-                    # We could have ended up here if the original input path's last point was equal to
-                    # its first point and the next path command was a 'z'. This is a workaround for
-                    # what I think is an improperly closed path.
-                    pass
-                last_letter = ptoken.letter
-            # finished reading in the path
-            if npath != None: # Was this path not closed?
-                if npath.style != None:
-                    if npath.tabmarker:
+                    raise inkex.AbortExtension("Only tab markers can be open paths")
+        if etransform:
+            self.transformPaths(npaths + markers, etransform)
+        for npath in npaths:
+            npath.buildCoords()
+        return npaths, markers
+
+    def pieceParams(self, svg):
+        # The settings buildPiece needs, in the user units of svg:
+        # (tab_height, tab_angle, dashlength, tabmarker, tabsets, scoredash)
+        scale = svg.unittouu('1'+self.options.unit)
+        dashlength = float(self.options.dashlength) * scale
+        # Let the renderer draw the dashes instead of writing out each one
+        scoredash = (self.options.scoremode == 'dasharray') and not math.isclose(dashlength, 0.0)
+        if self.options.preview:
+            # Draft quality: never explode the dashes
+            scoredash = not math.isclose(dashlength, 0.0)
+        return (float(self.options.tabheight) * scale, float(self.options.tabangle), dashlength,\
+                self.options.tabmarker, self.options.tabsets, scoredash)
+
+    def effect(self):
+        layer = self.svg.get_current_layer()
+        params = self.pieceParams(self.svg)
+        flatness = self.options.flatness * self.svg.unittouu('1'+self.options.unit)
+        markercolor = str(self.options.markercolor)
+        preview = self.options.preview
+        tablist = tabIndex() # contains pairs of points to put (or not put) tabs
+        elems = []
+        pc = 0
+        styles = styleCache()
+        with self.stage('select'):
+            if (self.options.selectclass != '') or (self.options.selectcolor != ''):
+                self.selectPaths(styles)
+            # The output goes in the current layer, so everything is brought into its coordinates
+            tcache = {}
+            tolayer = -self.composedTransform(layer, tcache)
+            # In preview mode, the geometry is kept between runs under a hash of everything
+            # that goes into reading it in, including the code that reads it
+            if preview:
+                import hashlib
+                gkey = hashlib.sha256(sourceHash() + repr((markercolor, flatness)).encode())
+            # The selected elements are only read from, never copied. Tab markers go to
+            # the front of the list and are taken out of the document straight away
+            for selem in self.svg.selection.filter(PathElement):
+                # Work out the transform while the element is still in the document
+                etransform = tolayer @ self.composedTransform(selem.getparent(), tcache) @ selem.transform
+                if preview:
+                    gkey.update(repr((selem.get_id(), selem.get('d'), selem.get('style'), etransform.to_hexad())).encode())
+                if ('style' in selem.attrib) and styles.hasStroke(selem.attrib['style'], markercolor):
+                    elems.insert(0,(selem,etransform)) # move element to the front of the list
+                    selem.delete() # we don't need it in the document
+                else:
+                    elems.append((selem,etransform))
+        if len(elems) == 0:
+            raise inkex.AbortExtension("Nothing selected")
+        with self.stage('read'):
+            geometry = self.loadPreview(gkey.hexdigest()) if preview else None
+            if geometry != None:
+                pieces, tablist = geometry
+            else:
+                pieces = [] # (npaths, id of the main path) for each element with closed paths
+                for elem, etransform in elems:
+                    npaths, markers = self.readElement(elem, etransform, styles, markercolor, flatness)
+                    for npath in markers:
                         # add its points to tab list
                         for npts in range(len(npath.path)-1):
-                            tablist.append([npath.path[npts], npath.path[npts+1]])
-                        # don't need this path anymore so delete it
-                        elem.delete()
-                        npath = None
-                    else:
-                        raise inkex.AbortExtension("Only tab markers can be open paths")
-            # check for cutouts
-            if idmod > 1:
-                for apath in npaths: # We test these paths to see if they are fully enclosed
-                    for bpath in npaths: # by these paths
-                        if apath.id != bpath.id:
-                            if self.pathInsidePath(bpath.path, apath.path):
-                                apath.enclosed = True
-            if len(npaths) > 0:
-                # add tabs to current path(s)
-                dsub = Path() # Used for building sub-paths
-                dprop = Path() # Used for building the main path
-                dscore = Path() # Used for building dashlines
-                dstyle = None
-                for apath in npaths:
-                    dstyle = apath.style
-                    mpath = Path()
-                    mpath.append(Move(apath.path[0].x,apath.path[0].y)) # init output path with first point of input path
-                    for ptn in range(len(apath.path)-1):
-                        if (tabsets == 'both') or (((tabsets == 'inside') and (apath.enclosed)) or ((tabsets == 'outside') and (not apath.enclosed))):
-                            if self.checkForTab(apath.path[ptn],apath.path[ptn+1],tablist,tabmarker):
-                                tabpt1, tabpt2 = self.makeTab(apath, apath.path[ptn], apath.path[ptn+1], tab_height, tab_angle)
-                                mpath.append(tabpt1)
-                                mpath.append(tabpt2)
-                                dscore = dscore + self.makescore(apath.path[ptn], apath.path[ptn+1],dashlength)
-                        mpath.append(apath.path[ptn+1])
-                    if apath.id == elem.get_id():
-                        for nodes in range(len(mpath)):
-                            if nodes == 0:
-                                dprop.append(Move(mpath[nodes].x,mpath[nodes].y)) # This is the main path, which should appear first
-                            else:
-                                dprop.append(Line(mpath[nodes].x,mpath[nodes].y))
-                        # and close the path
-                        dprop.append(ZoneClose())
+                            tablist.add(npath.path[npts], npath.path[npts+1])
+                    if len(npaths) > 0:
+                        pieces.append((npaths, elem.get_id()))
+                if preview:
+                    # Do everything that doesn't depend on the settings before saving it
+                    for npaths, mainid in pieces:
+                        self.preparePiece(npaths)
+                    self.savePreview(gkey.hexdigest(), (pieces, tablist))
+        # Once the tab list is complete, each piece can be worked out on its own
+        results = [None]*len(pieces)
+        with self.stage('cache lookup'):
+            if self.options.cache:
+                cache = resultCache()
+                keys = [self.pieceKey(npaths, mainid, tablist, params, cache.salt) for (npaths, mainid) in pieces]
+                for pn in range(len(pieces)):
+                    hit = cache.get(keys[pn])
+                    if hit != None:
+                        results[pn] = (hit[0], hit[1], pieces[pn][0][-1].style)
+                cache.flush() # So other processes can use the cache during the build
+        todo = [pn for pn in range(len(pieces)) if results[pn] == None]
+        with self.stage('build'):
+            jobs = self.options.jobs if self.options.jobs > 0 else (os.cpu_count() or 1)
+            if (jobs > 1) and (len(todo) > 1):
+                # Only plain data goes to the workers: the geometry, the tab list and the options
+                wopts = argparse.Namespace(**{k: v for k, v in vars(self.options).items()\
+                                              if isinstance(v, (str, int, float, bool, type(None)))})
+                import concurrent.futures
+                with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=initPieceWorker,\
+                                                            initargs=(wopts, tablist, params)) as pool:
+                    built = list(pool.map(pieceWorker, [pieces[pn] for pn in todo], chunksize=max(1, len(todo)//(jobs*4))))
+            else:
+                built = [self.buildPiece(pieces[pn][0], pieces[pn][1], tablist, params) for pn in todo]
+        for pn, result in zip(todo, built):
+            results[pn] = result
+        with self.stage('cache store'):
+            if self.options.cache:
+                for pn, result in zip(todo, built):
+                    cache.put(keys[pn], [result[0], result[1]])
+                cache.close()
+        with self.stage('write'):
+            seen = tabIndex() if self.options.mergescores else None
+            for (npaths, mainid), result in zip(pieces, results):
+                self.outputPiece(layer, pc, mainid, result, params, styles, seen)
+                pc += 1
+
+    def outputPiece(self, parent, pc, mainid, result, params, styles, seen=None):
+        # Adds the elements for a finished piece (the result of buildPiece) to parent.
+        # pc numbers the piece in the labels. seen is the tabIndex of the score lines
+        # written for earlier pieces, or None to write every score line as it is
+        dprop, dedges, dstyle = result
+        dashlength, scoredash = params[2], params[5]
+        dashcolor = str(self.options.dashcolor)
+        dscore = []
+        for (x1, y1, x2, y2) in (self.scoreRuns(dedges, seen) if seen is not None else dedges):
+            score = self.makescore(vec2(x1, y1), vec2(x2, y2), 0.0 if scoredash else dashlength)
+            if score != '':
+                dscore.append(score)
+        if math.isclose(dashlength, 0.0) or scoredash:
+            # lump together all the score lines
+            group = Group()
+            group.label = 'group'+str(pc)+'ms'
+            self.drawline(dprop,'model'+str(pc),group,dstyle) # Output the model
+            if len(dscore) > 0:
+                if scoredash:
+                    # Same dash pattern as makescore: dashlength space followed by dashlength mark
+                    if dstyle == None:
+                        dlstyle = styles.dashed(str(Style({'stroke':'#000000','stroke-width':'0.25','fill':'#eeeeee'})), dashlength)
                     else:
-                        for nodes in range(len(mpath)):
-                            if nodes == 0:
-                                dsub.append(Move(mpath[nodes].x,mpath[nodes].y)) # This is the sub path, which should appear after the main one
-                            else:
-                                dsub.append(Line(mpath[nodes].x,mpath[nodes].y))
-                        # and close the path
-                        dsub.append(ZoneClose())
-                dprop = dprop + dsub # combine all the paths
-                if math.isclose(dashlength, 0.0):
-                    # lump together all the score lines
-                    group = Group()
-                    group.label = 'group'+str(pc)+'ms'
-                    self.drawline(str(dprop),'model'+str(pc),group,dstyle) # Output the model
-                    if dscore != '':
-                        if dstyle == None:
-                            dlstyle = str(Style({'stroke':'#00ff00','stroke-width':'0.25','fill':'#eeeeee'}))
-                        else:
-                            strokeflag = False
-                            lsstr = dstyle.split(';')
-                            for stoken in range(len(lsstr)):
-                                if lsstr[stoken].startswith('stroke:'):
-                                    swt = lsstr[stoken].split(':')[1]
-                                    lsstr[stoken] = lsstr[stoken].replace(swt, dashcolor)
-                                    strokeflag = True
-                            if not strokeflag:
-                                lsstr.append('stroke:'+dashcolor)
-                            dlstyle = ";".join(lsstr)
-                        self.drawline(str(dscore),'score'+str(pc),group,dlstyle) # Output the scorelines separately
-                    layer.append(group)
+                        dlstyle = styles.dashed(dstyle, dashlength)
+                elif dstyle == None:
+                    dlstyle = str(Style({'stroke':'#00ff00','stroke-width':'0.25','fill':'#eeeeee'}))
                 else:
-                    dprop = dscore + dprop
-                    self.drawline(str(dprop),savid+'ms',layer,dstyle)
+                    dlstyle = styles.recolored(dstyle, dashcolor)
+                self.drawline(' '.join(dscore),'score'+str(pc),group,dlstyle) # Output the scorelines separately
+            parent.append(group)
+        else:
+            self.drawline(' '.join(dscore + [dprop]),mainid+'ms',parent,dstyle)
+
+    def extendsRun(self, run, x1, y1, x2, y2, tol):
+        # True if the edge (x1,y1)-(x2,y2) starts where run (x1,y1,x2,y2) ends and
+        # carries on in the same straight line, to within tol
+        sx, sy, ex, ey = run
+        if not (math.isclose(x1, ex, abs_tol=tol) and math.isclose(y1, ey, abs_tol=tol)):
+            return False
+        dx, dy = ex - sx, ey - sy
+        length = math.sqrt(dx*dx + dy*dy)
+        if math.isclose(length, 0.0):
+            return False
+        # How far the new end is from the run's line, and how far along it
+        off = (dx*(y2 - sy) - dy*(x2 - sx))/length
+        along = (dx*(x2 - sx) + dy*(y2 - sy))/length
+        return (abs(off) <= tol) and (along > length + tol)
+
+    def scoreRuns(self, edges, seen):
+        # Turns the edges to score of a piece into the lines to dash, as (x1,y1,x2,y2).
+        # Edges already in seen (a tabIndex of those scored for earlier pieces), such
+        # as one shared with a piece laid out next to this one, are left out, and the
+        # rest are added to it. An edge that carries straight on from the one before
+        # it is joined onto that one's line, so a straight run is dashed as one line
+        tol = seen.tol
+        runs = []
+        for (x1, y1, x2, y2) in edges:
+            pt1, pt2 = vec2(x1, y1), vec2(x2, y2)
+            if seen.contains(pt1, pt2):
+                continue
+            seen.add(pt1, pt2)
+            if (len(runs) > 0) and self.extendsRun(runs[-1], x1, y1, x2, y2, tol):
+                runs[-1] = (runs[-1][0], runs[-1][1], x2, y2)
+            else:
+                runs.append((x1, y1, x2, y2))
+        # Around a closed path, the last line can carry on into the first
+        if (len(runs) > 1) and self.extendsRun(runs[-1], runs[0][0], runs[0][1], runs[0][2], runs[0][3], tol):
+            last = runs.pop()
+            runs[0] = (last[0], last[1], runs[0][2], runs[0][3])
+        return runs
+
+    def streamNodes(self, infile):
+        # Reads the SVG file infile a bit at a time. Yields (event, node, transform) with
+        # event 'start' and 'end' for the svg element and the groups in it, 'leaf' for any
+        # other element once it's been read in whole, and 'other' for comments and
+        # processing instructions outside of those. transform is the composed transform
+        # of the innermost group. Nodes are dropped once they've been handed on, so only
+        # the groups being read are kept in memory
+        from lxml import etree
+        containers = (inkex.addNS('svg','svg'), inkex.addNS('g','svg'))
+        transforms = [Transform()]
+        depth = 0 # how far inside a leaf
+        def drop(node):
+            parent = node.getparent()
+            node.clear()
+            if parent is not None:
+                parent.remove(node)
+        for event, node in etree.iterparse(infile, events=('start','end','comment','pi'), huge_tree=True,\
+                                           remove_comments=False):
+            if event in ('comment', 'pi'):
+                if depth == 0:
+                    yield 'other', node, transforms[-1]
+                    drop(node)
+            elif event == 'start':
+                if (depth == 0) and (node.tag in containers):
+                    transforms.append(transforms[-1] @ Transform(node.get('transform')))
+                    yield 'start', node, transforms[-1]
+                else:
+                    depth += 1
+            elif depth > 0:
+                depth -= 1
+                if depth == 0:
+                    yield 'leaf', node, transforms[-1]
+                    drop(node)
+            else:
+                yield 'end', node, transforms.pop()
+                drop(node)
+
+    def streamRoot(self, node):
+        # The svg element node as an inkex document element (without any children),
+        # for working out units
+        return inkex.SVG_PARSER.makeelement(node.tag, dict(node.attrib), node.nsmap)
+
+    def streamSelected(self, node, styles):
+        # Returns node as an inkex PathElement (a copy, without any children) if it's
+        # a path that --id, --selectclass or --selectcolor selects, otherwise None
+        if node.tag != inkex.addNS('path','svg'):
+            return None
+        elem = inkex.SVG_PARSER.makeelement(node.tag, dict(node.attrib), node.nsmap)
+        if (elem.get('id') in self.options.ids) or self.pickedBy(elem, styles):
+            return elem
+        return None
+
+    def streamEffect(self, infile, outfile):
+        # Streaming version of effect() for batch use on documents too big to hold in
+        # memory. infile is read twice, a bit at a time: once for the selected tab
+        # markers, then again to copy it to outfile, with the model and score lines of
+        # each selected path written straight after it in the same group (rather than
+        # at the end of the current layer). Each piece is worked out in the coordinates
+        # of its group, as effect() works in those of the current layer. Paths are
+        # selected by --id, --selectclass and --selectcolor; --preview, --cache and
+        # --jobs don't apply
+        from lxml import etree
+        if self.options.profile != '':
+            self.startProfile()
+        markercolor = str(self.options.markercolor)
+        styles = styleCache()
+        markersegs = [] # the tab markers' edges, in the document's coordinates
+        with self.stage('read markers'):
+            for event, node, ctransform in self.streamNodes(infile):
+                if (event == 'start') and (node.getparent() is None):
+                    flatness = self.options.flatness * self.streamRoot(node).unittouu('1'+self.options.unit)
+                elem = self.streamSelected(node, styles) if event == 'leaf' else None
+                if (elem is not None) and styles.hasStroke(elem.attrib.get('style', ''), markercolor):
+                    npaths, markers = self.readElement(elem, ctransform @ elem.transform, styles, markercolor, flatness)
+                    for npath in markers:
+                        for npts in range(len(npath.path)-1):
+                            markersegs.append((npath.path[npts], npath.path[npts+1]))
+        def markup(node, scope):
+            # The XML for node, declaring only the namespaces that aren't in scope
+            wrapper = etree.Element('wrapper', nsmap=scope)
+            wrapper.append(node)
+            text = etree.tostring(wrapper, encoding='unicode')
+            return text[text.index('>')+1:-len('</wrapper>')]
+        params = None
+        selected = 0
+        pc = 0
+        # The tab markers and the score lines written so far, in the coordinates of
+        # each group transform met, so pieces in groups with different transforms
+        # aren't matched against each other
+        spaces = {}
+        with self.stage('stream'), open(outfile, 'w', encoding='utf-8') as out:
+            out.write("<?xml version='1.0' encoding='UTF-8'?>\n")
+            opened = [] # names of the open elements
+            for event, node, ctransform in self.streamNodes(infile):
+                parent = node.getparent()
+                scope = parent.nsmap if parent is not None else {}
+                if event == 'start':
+                    if parent is None:
+                        # The svg element's size and viewBox set the user units
+                        params = self.pieceParams(self.streamRoot(node))
+                        start = etree.tostring(etree.Element(node.tag, dict(node.attrib), nsmap=node.nsmap), encoding='unicode')
+                    else:
+                        start = markup(etree.Element(node.tag, dict(node.attrib), nsmap=node.nsmap), scope)
+                    out.write(start[:-2] + '>') # <g .../> less the /
+                    opened.append(start[1:].split()[0].rstrip('/>'))
+                    continue
+                if event == 'end':
+                    out.write('</' + opened.pop() + '>')
+                    continue
+                if event == 'other':
+                    out.write(etree.tostring(node, encoding='unicode', with_tail=False))
+                    continue
+                elem = self.streamSelected(node, styles)
+                if elem is None:
+                    out.write(markup(node, scope))
+                    continue
+                selected += 1
+                if styles.hasStroke(elem.attrib.get('style', ''), markercolor):
+                    continue # Tab markers are left out, as effect() deletes them
+                out.write(markup(node, scope))
+                npaths, markers = self.readElement(elem, elem.transform, styles, markercolor, flatness)
+                if len(npaths) == 0:
+                    continue
+                space = ctransform.to_hexad()
+                if space not in spaces:
+                    togroup = -ctransform
+                    tablist = tabIndex()
+                    for (pt1, pt2) in markersegs:
+                        tpt1, tpt2 = togroup.apply_to_point((pt1.x, pt1.y)), togroup.apply_to_point((pt2.x, pt2.y))
+                        tablist.add(vec2(tpt1.x, tpt1.y), vec2(tpt2.x, tpt2.y))
+                    spaces[space] = (tablist, tabIndex() if self.options.mergescores else None)
+                tablist, seen = spaces[space]
+                holder = Group()
+                self.outputPiece(holder, pc, elem.get_id(), self.buildPiece(npaths, elem.get_id(), tablist, params),\
+                                 params, styles, seen)
+                for child in list(holder):
+                    out.write(markup(child, scope))
                 pc += 1
+            out.write('\n')
+        if selected == 0:
+            os.remove(outfile)
+            raise inkex.AbortExtension("Nothing selected")
+
+    def pieceKey(self, npaths, mainid, tablist, params, salt=b''):
+        # Hash of everything buildPiece's path data depends on: the coordinates of each
+        # subpath (which also decide which ones are cutouts), which one is the main
+        # path, which edges get tabs, and the tab and score settings
+        import hashlib
+        key = hashlib.sha256(salt)
+        key.update(repr(params + (self.options.tabside, self.options.fixoverlaps)).encode())
+        for apath in npaths:
+            key.update(b'M' if apath.id == mainid else b'S')
+            key.update(apath.coords.tobytes())
+            key.update(bytes([self.checkForTab(apath.path[ptn],apath.path[ptn+1],tablist,params[3])\
+                              for ptn in range(len(apath.path)-1)]))
+        return key.hexdigest()
+
+    def preparePiece(self, npaths):
+        # The parts of a piece that only depend on its geometry
+        # check for cutouts
+        if len(npaths) > 1:
+            self.nestPaths(npaths)
+        for apath in npaths:
+            # Orientation of each polygon, used to find the outside of its edges
+            area = self.signedArea(apath.path)
+            apath.winding = (area > 0.0) - (area < 0.0)
+            apath.nested = True
+
+    def previewFile(self):
+        return os.path.join(resultCache.cacheDir(), 'preview.pickle')
+
+    def loadPreview(self, gkey):
+        # Returns the (pieces, tablist) saved by the last preview run if it was for
+        # the same geometry, otherwise None
+        import pickle
+        try:
+            with open(self.previewFile(), 'rb') as pfile:
+                key, geometry = pickle.load(pfile)
+        except Exception: # missing, unreadable or from a different version
+            return None
+        return geometry if key == gkey else None
+
+    def savePreview(self, gkey, geometry):
+        import pickle
+        os.makedirs(os.path.dirname(self.previewFile()), exist_ok=True)
+        with open(self.previewFile(), 'wb') as pfile:
+            pickle.dump((gkey, geometry), pfile, pickle.HIGHEST_PROTOCOL)
+
+    def buildPiece(self, npaths, mainid, tablist, params):
+        # Works out the tabs and score lines for the closed paths of one element
+        # npaths - the element's pathStructs; mainid - the id of its main path
+        # params - (tab_height, tab_angle, dashlength, tabmarker, tabsets, scoredash)
+        # Returns the model path data, the list of edges to score and the style.
+        # The score lines are dashed once all the pieces are done, see scoreRuns
+        tab_height, tab_angle, dashlength, tabmarker, tabsets, scoredash = params
+        if not npaths[0].nested:
+            self.preparePiece(npaths)
+        # add tabs to current path(s)
+        # The output is built up as lists of path data fragments and joined
+        # once per output element, so it takes time in line with its size
+        dsub = [] # Used for building sub-paths
+        dprop = [] # Used for building the main path
+        dscore = [] # Edges to score, as (x1,y1,x2,y2)
+        dstyle = None
+        # Work out all of the piece's tabs first, so that they can be checked
+        # against each other and against its edges before any is written out
+        tabs = {} # (subpath number, edge number) -> the two tab points
+        for pn, apath in enumerate(npaths):
+            if (tabsets == 'both') or (((tabsets == 'inside') and (apath.enclosed)) or ((tabsets == 'outside') and (not apath.enclosed))):
+                for ptn in range(len(apath.path)-1):
+                    if self.checkForTab(apath.path[ptn],apath.path[ptn+1],tablist,tabmarker):
+                        tabs[(pn,ptn)] = self.makeTab(apath, apath.path[ptn], apath.path[ptn+1], tab_height, tab_angle)
+        if self.options.fixoverlaps and (len(tabs) > 0):
+            self.shrinkOverlappingTabs(npaths, tabs)
+        for pn, apath in enumerate(npaths):
+            dstyle = apath.style
+            mpath = ['M {:g} {:g}'.format(apath.path[0].x,apath.path[0].y)] # init output path with first point of input path
+            for ptn in range(len(apath.path)-1):
+                if (pn,ptn) in tabs:
+                    tabpt1, tabpt2 = tabs[(pn,ptn)]
+                    mpath.append('L {:g} {:g}'.format(tabpt1.x,tabpt1.y))
+                    mpath.append('L {:g} {:g}'.format(tabpt2.x,tabpt2.y))
+                    dscore.append((apath.path[ptn].x, apath.path[ptn].y, apath.path[ptn+1].x, apath.path[ptn+1].y))
+                mpath.append('L {:g} {:g}'.format(apath.path[ptn+1].x,apath.path[ptn+1].y))
+            # and close the path
+            mpath.append('Z')
+            if apath.id == mainid:
+                dprop.extend(mpath) # This is the main path, which should appear first
+            else:
+                dsub.extend(mpath) # This is the sub path, which should appear after the main one
+        dprop = ' '.join(dprop + dsub) # combine all the paths
+        return dprop, dscore, dstyle
+
+# State of each process in the --jobs pool, set up once per process
+pieceEngine = None
+
+def initPieceWorker(options, tablist, params):
+    global pieceEngine
+    pieceEngine = Tabgen()
+    pieceEngine.options = options
+    pieceEngine.tablist = tablist
+    pieceEngine.params = params
+
+def pieceWorker(piece):
+    npaths, mainid = piece
+    return pieceEngine.buildPiece(npaths, mainid, pieceEngine.tablist, pieceEngine.params)
+
+def batch(args):
+    # Headless batch mode: runs Tabgen on each SVG file given (or found in each
+    # directory given) and writes the results to an output directory.
+    # Any other options are passed on to Tabgen, and must be given as --option=value
+    import glob, concurrent.futures
+    parser = argparse.ArgumentParser(prog="tabgen.py --batch",\
+        description="Run Tabgen on many SVG files without Inkscape. Select paths with "
+                    "--id, --selectclass or --selectcolor; all other Tabgen options apply.")
+    parser.add_argument("--outdir", required=True,\
+        help="Directory to write the processed files to")
+    parser.add_argument("--jobs", type=int, default=1,\
+        help="Number of processes (0 for one per CPU). With several files, each process takes whole files")
+    parser.add_argument("--stream", action="store_true",\
+        help="Read and write each file a bit at a time, for files too big to hold in memory")
+    parser.add_argument("inputs", nargs="+",\
+        help="SVG files, or directories of SVG files")
+    bopts, tgargs = parser.parse_known_args(args)
+    files = []
+    for name in bopts.inputs:
+        if os.path.isdir(name):
+            files.extend(sorted(glob.glob(os.path.join(name, '*.svg'))))
+        else:
+            files.append(name)
+    # Every output goes straight into --outdir, so two inputs with one name would collide
+    outnames = {}
+    for infile in files:
+        outnames.setdefault(os.path.basename(infile), []).append(infile)
+    clashes = [infiles for infiles in outnames.values() if len(infiles) > 1]
+    if clashes:
+        parser.error("these would all be written to the same file in --outdir: " +\
+                     "; ".join(", ".join(infiles) for infiles in clashes))
+    os.makedirs(bopts.outdir, exist_ok=True)
+    jobs = bopts.jobs if bopts.jobs > 0 else (os.cpu_count() or 1)
+    if (jobs > 1) and (len(files) > 1):
+        # Spread the files over the pool, and process each one in a single process
+        tasks = [(tgargs + ['--jobs=1'], infile, bopts.outdir, bopts.stream) for infile in files]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(batchFile, tasks))
+    else:
+        results = [batchFile((tgargs + ['--jobs=' + str(bopts.jobs)], infile, bopts.outdir, bopts.stream)) for infile in files]
+    failed = results.count(False)
+    sys.stderr.write("Processed {0} file(s), {1} failed\n".format(len(files), failed))
+    return 1 if failed > 0 else 0
+
+def batchFile(task):
+    # Runs Tabgen on one file for batch(). Returns False if it failed
+    tgargs, infile, outdir, stream = task
+    outfile = os.path.join(outdir, os.path.basename(infile))
+    try:
+        if stream:
+            ext = Tabgen()
+            ext.parse_arguments(tgargs + [infile])
+            try:
+                ext.streamEffect(infile, outfile)
+            finally:
+                ext.clean_up()
+        else:
+            Tabgen().run(tgargs + ['--output=' + outfile, infile])
+    except inkex.AbortExtension as err:
+        inkex.errormsg(str(err))
+        sys.stderr.write("{0}: failed\n".format(infile))
+        return False
+    except SystemExit as err: # run() exits when the extension aborts
+        if err.code not in (None, 0):
+            sys.stderr.write("{0}: failed\n".format(infile))
+            return False
+    except Exception: # A bug or a file Tabgen can't read: report it and go on to the next file
+        import traceback
+        sys.stderr.write("{0}: failed\n{1}".format(infile, traceback.format_exc()))
+        return False
+    return True
+
+def serve(args):
+    # Server mode: keeps Python, inkex and Tabgen loaded and runs Tabgen for each
+    # request from tabgen_client.py, so Inkscape doesn't pay the start-up cost every run
+    import signal, socket, tabgen_client
+    parser = argparse.ArgumentParser(prog="tabgen.py --serve",\
+        description="Serve Tabgen requests from tabgen_client.py over a Unix socket.")
+    parser.add_argument("--socket", default=tabgen_client.socketPath(),\
+        help="Socket to listen on (default: %(default)s)")
+    sopts = parser.parse_args(args)
+    if not hasattr(socket, 'AF_UNIX'):
+        sys.stderr.write("Server mode needs Unix sockets\n")
+        return 1
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(sopts.socket)
+            sys.stderr.write("A server is already listening on {0}\n".format(sopts.socket))
+            return 1
+        except OSError: # Nothing listening, so clear out any stale socket file
+            if os.path.exists(sopts.socket):
+                os.unlink(sopts.socket)
+    sockdir = os.path.dirname(os.path.abspath(sopts.socket))
+    if not os.path.isdir(sockdir):
+        os.makedirs(sockdir, mode=0o700)
+    st = os.stat(sockdir)
+    if (st.st_uid != os.getuid()) or (st.st_mode & 0o022):
+        # Someone else could swap the socket for their own there
+        sys.stderr.write("{0} must belong to you and not be writable by others\n".format(sockdir))
+        return 1
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    oldmask = os.umask(0o077) # Only this user may connect
+    try:
+        listener.bind(sopts.socket)
+    finally:
+        os.umask(oldmask)
+    listener.listen(8)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0)) # Tidy up on kill as well
+    sys.stderr.write("Tabgen listening on {0}\n".format(sopts.socket))
+    try:
+        while True:
+            conn, _ = listener.accept()
+            with conn:
+                try:
+                    request, document = tabgen_client.recvMessage(conn)
+                    status, errtext, output = serveRequest(request, document)
+                    tabgen_client.sendMessage(conn, {'status': status, 'stderr': errtext}, output)
+                except ConnectionError: # Client went away
+                    pass
+                except (OSError, ValueError) as err: # Client sent garbage
+                    sys.stderr.write("Dropped request: {0}\n".format(err))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+        os.unlink(sopts.socket)
+    return 0
+
+def serveRequest(request, document):
+    # Runs Tabgen on one document for serve(), the way Tabgen().run() would.
+    # Returns the exit status, what was written to stderr and the output document
+    import traceback
+    errors = io.StringIO()
+    output = io.BytesIO()
+    status = 0
+    docpath = os.environ.get('DOCUMENT_PATH') # The server's own, put back afterwards
+    if request.get('document_path') is not None:
+        os.environ['DOCUMENT_PATH'] = request['document_path']
+    ext = Tabgen()
+    with contextlib.redirect_stderr(errors):
+        try:
+            ext.parse_arguments(request['args'])
+            ext.options.input_file = io.BytesIO(document)
+            ext.options.output = output
+            ext.load_raw()
+            ext.save_raw(ext.effect())
+        except inkex.AbortExtension as err:
+            inkex.errormsg(str(err))
+            status = inkex.utils.ABORT_STATUS
+        except SystemExit as err: # argparse exits on bad options
+            status = err.code if isinstance(err.code, int) else 1
+        except Exception: # Report it to the client and keep serving
+            traceback.print_exc()
+            status = 1
+        finally:
+            ext.clean_up()
+            if docpath is None:
+                os.environ.pop('DOCUMENT_PATH', None)
+            else:
+                os.environ['DOCUMENT_PATH'] = docpath
+    return status, errors.getvalue(), output.getvalue()
 
 if __name__ == '__main__':
+    if '--batch' in sys.argv[1:]:
+        sys.exit(batch([arg for arg in sys.argv[1:] if arg != '--batch']))
+    if '--serve' in sys.argv[1:]:
+        sys.exit(serve([arg for arg in sys.argv[1:] if arg != '--serve']))
     Tabgen().run()
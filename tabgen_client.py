@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright (C) [2022] [Joseph Zakar], [observing@gmail.com]
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+"""
+Thin client for a Tabgen server started with "python tabgen.py --serve". It hands the
+document and options to the server, which already has Python, inkex and Tabgen loaded.
+If no server is running, Tabgen is run in this process as usual.
+
+Only the standard library is used here, so that starting the client is cheap.
+"""
+
+import os
+import sys
+import json
+import socket
+import struct
+import tempfile
+
+def socketPath():
+    # Where the server listens. TABGEN_SOCKET overrides the default. The temporary
+    # directory is shared, so there the socket goes in a directory of its own that
+    # the server creates for this user only
+    if 'TABGEN_SOCKET' in os.environ:
+        return os.environ['TABGEN_SOCKET']
+    if 'XDG_RUNTIME_DIR' in os.environ:
+        return os.path.join(os.environ['XDG_RUNTIME_DIR'], 'tabgen.sock')
+    return os.path.join(tempfile.gettempdir(), 'tabgen-{0}'.format(os.getuid()), 'tabgen.sock')
+
+def ownSocket(path):
+    # True if path belongs to this user and nobody else can connect to it. Anyone
+    # could have made a socket by that name, and the document goes to whoever listens
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return (st.st_uid == os.getuid()) and ((st.st_mode & 0o077) == 0)
+
+# A message is a JSON header followed by a block of bytes, each sent with its length
+
+def recvExactly(conn, size):
+    chunks = []
+    while size > 0:
+        chunk = conn.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("Connection closed early")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+def sendMessage(conn, header, data):
+    hdr = json.dumps(header).encode()
+    conn.sendall(struct.pack('!IQ', len(hdr), len(data)) + hdr)
+    conn.sendall(data)
+
+def recvMessage(conn):
+    hlen, dlen = struct.unpack('!IQ', recvExactly(conn, 12))
+    header = json.loads(recvExactly(conn, hlen).decode())
+    return header, recvExactly(conn, dlen)
+
+def runLocally(args):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import tabgen
+    tabgen.Tabgen().run(args)
+    return 0
+
+def main(args):
+    # Inkscape passes the options followed by the name of the document
+    if (len(args) > 0) and (not args[-1].startswith('-')) and os.path.isfile(args[-1]):
+        options, infile = args[:-1], args[-1]
+    else:
+        options, infile = args, None
+    if (os.name != 'posix') or (not hasattr(socket, 'AF_UNIX')) or (not ownSocket(socketPath())):
+        return runLocally(args)
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(socketPath())
+    except OSError: # No server, so do it ourselves
+        conn.close()
+        return runLocally(args)
+    with conn:
+        if infile is None:
+            document = sys.stdin.buffer.read()
+        else:
+            with open(infile, 'rb') as doc:
+                document = doc.read()
+        sendMessage(conn, {'args': options, 'document_path': os.environ.get('DOCUMENT_PATH', infile)}, document)
+        reply, output = recvMessage(conn)
+    sys.stderr.write(reply['stderr'])
+    sys.stdout.buffer.write(output)
+    return reply['status']
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
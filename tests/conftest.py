@@ -0,0 +1,57 @@
+# Shared helpers for the Tabgen tests. Tabgen is run the way batch mode runs it, on
+# small SVG documents written to a temporary directory, and its output is read
+# back with inkex
+import os
+import sys
+
+import inkex
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tabgen
+
+STYLE = 'fill:none;stroke:#000000;stroke-width:0.25'
+MARKER = 'fill:none;stroke:#ff0000;stroke-width:0.25'
+
+def svgDocument(body, layertransform=''):
+    # A 100x100 document whose current layer holds body, under layertransform
+    transform = ' transform="{0}"'.format(layertransform) if layertransform else ''
+    return ('<svg xmlns="http://www.w3.org/2000/svg" xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape"'
+            ' xmlns:sodipodi="http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd"'
+            ' width="100mm" height="100mm" viewBox="0 0 100 100">'
+            '<sodipodi:namedview id="nv" inkscape:current-layer="layer1"/>'
+            '<g id="layer1" inkscape:groupmode="layer"' + transform + '>' + body + '</g></svg>')
+
+def pathElement(pid, d, style=STYLE, transform=''):
+    extra = ' transform="{0}"'.format(transform) if transform else ''
+    return '<path id="{0}" d="{1}" style="{2}"{3}/>'.format(pid, d, style, extra)
+
+def generated(filename, sources):
+    # The elements Tabgen added to the document, by label: the stroke width and any
+    # dash pattern, then every path coordinate, all in the document's coordinates
+    svg = inkex.load_svg(filename).getroot()
+    shapes = {}
+    for el in svg.descendants().filter(inkex.PathElement):
+        if el.get_id() in sources:
+            continue
+        transform = el.composed_transform()
+        scale = abs(transform.a*transform.d - transform.b*transform.c) ** 0.5
+        dash = el.style.get('stroke-dasharray')
+        shapes[el.label] = [float(el.style.get('stroke-width'))*scale] +\
+                           ([float(v)*scale for v in dash.split(',')] if dash else []) +\
+                           [c for seg in el.path.transform(transform).to_absolute() for c in seg.args]
+    return shapes
+
+@pytest.fixture
+def runTabgen(tmp_path):
+    # Runs Tabgen on a document and returns what it generated, see generated()
+    def run(document, options, stream=False):
+        source = tmp_path / 'in.svg'
+        source.write_text(document)
+        outdir = tmp_path / ('stream' if stream else 'out')
+        args = ['--outdir=' + str(outdir)] + (['--stream'] if stream else []) + options + [str(source)]
+        assert tabgen.batch(args) == 0
+        sources = [opt.split('=', 1)[1] for opt in options if opt.startswith('--id=')]
+        return generated(str(outdir / 'in.svg'), sources)
+    return run
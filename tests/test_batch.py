@@ -0,0 +1,33 @@
+# Batch mode over several files
+import pytest
+
+import tabgen
+from conftest import svgDocument, pathElement
+
+SQUARE = 'M 0,0 L 20,0 L 20,20 L 0,20 Z'
+
+@pytest.fixture
+def inputs(tmp_path):
+    indir = tmp_path / 'in'
+    indir.mkdir()
+    for name in ('a', 'b', 'c'):
+        (indir / (name + '.svg')).write_text(svgDocument(pathElement('p', SQUARE) + pathElement('e', '')))
+    return indir
+
+def test_empty_path(inputs, tmp_path):
+    # An empty path has nothing to add tabs to, but mustn't stop the run
+    assert tabgen.batch(['--outdir=' + str(tmp_path / 'out'), '--id=p', '--id=e', str(inputs)]) == 0
+    assert sorted(f.name for f in (tmp_path / 'out').iterdir()) == ['a.svg', 'b.svg', 'c.svg']
+
+def test_failed_file_skipped(inputs, tmp_path, monkeypatch, capsys):
+    effect = tabgen.Tabgen.effect
+    def failing(self):
+        if self.options.input_file.endswith('b.svg'):
+            raise RuntimeError('broken')
+        return effect(self)
+    monkeypatch.setattr(tabgen.Tabgen, 'effect', failing)
+    assert tabgen.batch(['--outdir=' + str(tmp_path / 'out'), '--id=p', str(inputs)]) == 1
+    assert sorted(f.name for f in (tmp_path / 'out').iterdir()) == ['a.svg', 'c.svg']
+    errors = capsys.readouterr().err
+    assert 'b.svg: failed' in errors and 'RuntimeError: broken' in errors
+    assert 'Processed 3 file(s), 1 failed' in errors
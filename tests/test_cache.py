@@ -0,0 +1,63 @@
+# The on-disk caches: finished pieces, shared by Tabgen processes, and --preview geometry
+import sqlite3
+
+import pytest
+
+import tabgen
+from conftest import svgDocument, pathElement
+
+@pytest.fixture
+def cachePath(tmp_path):
+    path = tmp_path / 'pieces.sqlite'
+    cache = tabgen.resultCache(str(path))
+    cache.put('a', ['M 0 0', []])
+    cache.close()
+    return str(path)
+
+def otherWriter(path):
+    # Another process in the middle of writing to the cache
+    other = sqlite3.connect(path, timeout=0)
+    other.execute('BEGIN IMMEDIATE')
+    return other
+
+def test_hits_leave_cache_writable(cachePath):
+    cache = tabgen.resultCache(cachePath, timeout=0.1)
+    assert cache.get('a') == ['M 0 0', []]
+    otherWriter(cachePath).rollback() # doesn't wait for this run's build
+    cache.flush()
+    otherWriter(cachePath).rollback()
+    cache.close()
+
+def test_locked_cache_is_skipped(cachePath):
+    cache = tabgen.resultCache(cachePath, timeout=0.1)
+    other = otherWriter(cachePath)
+    assert cache.get('a') == ['M 0 0', []]
+    assert cache.get('b') is None
+    cache.put('b', ['M 1 1', []])
+    cache.flush() # neither raises, the store is just dropped
+    cache.close()
+    other.rollback()
+    cache = tabgen.resultCache(cachePath, timeout=0.1)
+    assert cache.get('b') is None
+    cache.put('b', ['M 1 1', []])
+    cache.close()
+    assert tabgen.resultCache(cachePath).get('b') == ['M 1 1', []]
+
+def test_preview_not_reused_by_other_version(runTabgen, tmp_path, monkeypatch):
+    # The geometry saved by --preview is only loaded back by the same tabgen.py
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    keys = []
+    loadPreview = tabgen.Tabgen.loadPreview
+    def recording(self, gkey):
+        geometry = loadPreview(self, gkey)
+        keys.append((gkey, geometry is not None))
+        return geometry
+    monkeypatch.setattr(tabgen.Tabgen, 'loadPreview', recording)
+    document = svgDocument(pathElement('a', 'M 0,0 L 20,0 L 20,20 L 0,20 Z'))
+    options = ['--id=a', '--unit=mm', '--preview=true']
+    runTabgen(document, options)
+    runTabgen(document, options)
+    monkeypatch.setattr(tabgen, 'sourceHash', lambda: b'another version')
+    runTabgen(document, options)
+    assert [hit for (gkey, hit) in keys] == [False, True, False]
+    assert keys[2][0] != keys[1][0]
@@ -0,0 +1,57 @@
+# Flattening curves into straight edges to within --flatness
+import io
+import math
+
+import inkex
+import pytest
+
+import tabgen
+from conftest import svgDocument, pathElement
+
+def cubicPoint(t, p0, p1, p2, p3):
+    s = 1.0 - t
+    return tuple(s*s*s*a + 3*s*s*t*b + 3*s*t*t*c + t*t*t*d for (a, b, c, d) in zip(p0, p1, p2, p3))
+
+def distanceToPolyline(pt, polyline):
+    best = math.inf
+    for (ax, ay), (bx, by) in zip(polyline, polyline[1:]):
+        dx, dy = bx - ax, by - ay
+        t = max(0.0, min(1.0, ((pt[0]-ax)*dx + (pt[1]-ay)*dy)/(dx*dx + dy*dy)))
+        best = min(best, math.hypot(ax + t*dx - pt[0], ay + t*dy - pt[1]))
+    return best
+
+CUBICS = [
+    ((55.23, 0.0), (100.0, 44.77), (100.0, 100.0)), # a quarter circle
+    ((100.0, 80.0), (-40.0, 80.0), (60.0, 0.0)), # an S bend
+    ((80.0, 60.0), (-20.0, 60.0), (0.0, 0.0)), # a closed loop
+]
+
+@pytest.mark.parametrize('p1, p2, p3', CUBICS)
+@pytest.mark.parametrize('tol', [1.0, 0.1, 0.01])
+def test_cubic_within_tolerance(p1, p2, p3, tol):
+    polyline = [(0.0, 0.0)] + list(tabgen.flattenCubic(*(p1 + p2 + p3 + (tol,))))
+    assert polyline[-1] == pytest.approx(p3)
+    for k in range(501):
+        assert distanceToPolyline(cubicPoint(k/500.0, (0.0, 0.0), p1, p2, p3), polyline) <= tol*1.001
+
+@pytest.mark.parametrize('p1, p2, p3', CUBICS)
+def test_finer_tolerance_gives_more_edges(p1, p2, p3):
+    counts = [len(tabgen.flattenCubic(*(p1 + p2 + p3 + (tol,)))) for tol in (1.0, 0.1, 0.01)]
+    assert counts[0] < counts[1] < counts[2]
+
+@pytest.mark.parametrize('flatness', [0.5, 0.05])
+def test_circle_flatness_after_transform(flatness):
+    # flatness is measured in the coordinates the path is read into, here five times
+    # its own. Edges are chords of the circle, furthest from it at their middle
+    svg = inkex.load_svg(io.BytesIO(svgDocument(pathElement('c', 'M 10,0 A 10,10 0 0 1 -10,0 A 10,10 0 0 1 10,0 Z')).encode()))
+    circle = svg.getroot().getElementById('c')
+    npaths, markers = tabgen.Tabgen().readElement(circle, inkex.Transform('scale(5)'), tabgen.styleCache(),\
+                                                  '#ff0000', flatness)
+    assert (len(npaths), len(markers)) == (1, 0)
+    path = npaths[0].path
+    # The arc itself becomes cubics that are within 0.03% of the radius
+    slack = 50.0*3e-4
+    for pt in path:
+        assert math.hypot(pt.x, pt.y) == pytest.approx(50.0, abs=slack)
+    for pt1, pt2 in zip(path, path[1:]):
+        assert 50.0 - math.hypot((pt1.x + pt2.x)/2.0, (pt1.y + pt2.y)/2.0) <= flatness + slack
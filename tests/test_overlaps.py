@@ -0,0 +1,87 @@
+# Shrinking tabs that would overlap other tabs or edges of their piece (--fixoverlaps)
+import math
+
+import pytest
+
+from conftest import svgDocument, pathElement
+
+NOTCH = 'M 0,0 L 20,0 L 20,20 L 10,2 L 0,20 Z' # a sharp inside corner at (10,2)
+SLOT = 'M 0,0 L 40,0 L 40,40 L 0,40 Z M 10,19 L 30,19 L 30,21 L 10,21 Z' # a cutout 2 wide
+SQUARE = 'M 0,0 L 20,0 L 20,20 L 0,20 Z'
+OPTIONS = ['--id=a', '--unit=mm', '--tabheight=3', '--tabangle=45', '--dashlength=0']
+
+def model(runTabgen, d, fix):
+    # The model path's points, split into closed subpaths
+    coords = runTabgen(svgDocument(pathElement('a', d)), OPTIONS + ['--fixoverlaps=' + fix])['model0'][1:]
+    points = list(zip(coords[0::2], coords[1::2]))
+    subpaths = []
+    while points:
+        end = next(k for k in range(1, len(points)) if math.dist(points[k], points[0]) < 1e-6)
+        subpaths.append(points[:end+1])
+        points = points[end+1:]
+    return subpaths
+
+def flat(points):
+    return [c for pt in points for c in pt]
+
+def crosses(a, b, c, d):
+    # True if segments ab and cd cross, not just touch
+    def side(p, q, r):
+        return (q[0]-p[0])*(r[1]-p[1]) - (q[1]-p[1])*(r[0]-p[0])
+    eps = 1e-9
+    d1, d2, d3, d4 = side(a, b, c), side(a, b, d), side(c, d, a), side(c, d, b)
+    return (d1*d2 < -eps) and (d3*d4 < -eps)
+
+def selfCrossing(subpaths):
+    # True if any two edges of the outline cross, so tabs overlap each other or the piece
+    edges = [(sp[k], sp[k+1]) for sp in subpaths for k in range(len(sp)-1)]
+    return any(crosses(*edges[i], *edges[j]) for i in range(len(edges)) for j in range(i+1, len(edges)))
+
+def sideAngle(vertex, along, top):
+    # Angle in degrees between a tab side from vertex to top and its edge from vertex to along
+    ex, ey = along[0]-vertex[0], along[1]-vertex[1]
+    sx, sy = top[0]-vertex[0], top[1]-vertex[1]
+    return math.degrees(math.acos((ex*sx + ey*sy)/math.hypot(ex, ey)/math.hypot(sx, sy)))
+
+def test_inside_corner(runTabgen):
+    fixed = model(runTabgen, NOTCH, 'true')
+    assert selfCrossing(model(runTabgen, NOTCH, 'false'))
+    assert not selfCrossing(fixed)
+    outline = fixed[0]
+    # The tabs away from the notch are left alone
+    assert flat(outline[:8]) == pytest.approx(flat(model(runTabgen, NOTCH, 'false')[0][:8]))
+    # The sides at the notch lean in, shallower than 45 degrees to their edges
+    notch = next(k for k, pt in enumerate(outline) if math.dist(pt, (10.0, 2.0)) < 1e-6)
+    assert 0.0 < sideAngle((10.0, 2.0), (20.0, 20.0), outline[notch-1]) < 44.0
+    assert 0.0 < sideAngle((10.0, 2.0), (0.0, 20.0), outline[notch+1]) < 44.0
+
+def test_narrow_cutout(runTabgen):
+    assert selfCrossing(model(runTabgen, SLOT, 'false'))
+    fixed = model(runTabgen, SLOT, 'true')
+    assert not selfCrossing(fixed)
+    # The tabs on the long edges are lowered until they both fit in the slot
+    cutout = fixed[1]
+    assert all(19.0 <= y <= 21.0 for (x, y) in cutout)
+    # The tops of those tabs, less the tiny ones on the short edges
+    low = [y - 19.0 for (x, y) in cutout if 19.0 < y < 19.99]
+    high = [21.0 - y for (x, y) in cutout if 20.01 < y < 21.0]
+    assert (len(low), len(high)) == (2, 2)
+    assert (min(low) > 0.0) and (min(high) > 0.0) and (max(low) + max(high) <= 2.0)
+
+def test_plain_square_unchanged(runTabgen):
+    # 45 degree tabs at a square corner only meet along a line, so stay as they are
+    fixed = model(runTabgen, SQUARE, 'true')
+    assert flat(fixed[0]) == pytest.approx(flat(model(runTabgen, SQUARE, 'false')[0]))
+    assert min(x for (x, y) in fixed[0]) == pytest.approx(-3.0)
+    assert max(y for (x, y) in fixed[0]) == pytest.approx(23.0)
+
+@pytest.mark.parametrize('d, expected', [
+    (NOTCH, [(0, 0), (3, -3), (17, -3), (20, 0), (23, 3), (23, 17), (20, 20), (15.9206, 18.8345),\
+             (8.8345, 6.0794), (10, 2), (11.1655, 6.0794), (4.0794, 18.8345), (0, 20), (-3, 17), (-3, 3), (0, 0)]),
+    (SLOT, [(0, 0), (3, -3), (37, -3), (40, 0), (43, 3), (43, 37), (40, 40), (37, 43), (3, 43), (0, 40),\
+            (-3, 37), (-3, 3), (0, 0), (10, 19), (13, 22), (27, 22), (30, 19), (27, 19.999), (27, 20.001),\
+            (30, 21), (27, 18), (13, 18), (10, 21), (13, 20.001), (13, 19.999), (10, 19)]),
+])
+def test_fix_off_keeps_old_output(runTabgen, d, expected):
+    # Every tab at full size, as before --fixoverlaps
+    assert flat(sum(model(runTabgen, d, 'false'), [])) == pytest.approx(flat(expected), abs=1e-4)
@@ -0,0 +1,44 @@
+# Score lines: edges shared by two pieces and straight runs of edges are scored once
+import pytest
+
+from conftest import svgDocument, pathElement
+
+OPTIONS = ['--unit=mm', '--dashlength=0']
+
+def scoreLines(shapes):
+    # Every score line drawn, as ((x1,y1),(x2,y2)) with the ends in order
+    lines = []
+    for label, values in shapes.items():
+        if label.startswith('score'):
+            coords = [round(c, 6) for c in values[1:]]
+            for k in range(0, len(coords), 4):
+                lines.append(tuple(sorted([tuple(coords[k:k+2]), tuple(coords[k+2:k+4])])))
+    return sorted(lines)
+
+def test_shared_edge_scored_once(runTabgen):
+    document = svgDocument(pathElement('a', 'M 0,0 L 10,0 L 10,10 L 0,10 Z') +\
+                           pathElement('b', 'M 10,0 L 20,0 L 20,10 L 10,10 Z'))
+    options = OPTIONS + ['--id=a', '--id=b']
+    merged = scoreLines(runTabgen(document, options + ['--mergescores=true']))
+    separate = scoreLines(runTabgen(document, options + ['--mergescores=false']))
+    shared = ((10.0, 0.0), (10.0, 10.0))
+    assert separate.count(shared) == 2
+    assert merged.count(shared) == 1
+    assert len(merged) == len(set(merged)) == 7
+    assert set(merged) == set(separate)
+
+@pytest.mark.parametrize('d', [
+    'M 0,0 L 10,0 L 20,0 L 20,10 L 0,10 Z',
+    'M 10,0 L 20,0 L 20,10 L 0,10 L 0,0 Z', # the run wraps around the start
+    'M 0,0 L 10,0 L 20,0 L 20,10 L 10,10 L 0,10 Z',
+])
+def test_straight_run_scored_as_one_line(runTabgen, d):
+    merged = scoreLines(runTabgen(svgDocument(pathElement('a', d)), OPTIONS + ['--id=a', '--mergescores=true']))
+    assert merged == sorted([((0.0, 0.0), (20.0, 0.0)), ((20.0, 0.0), (20.0, 10.0)),\
+                             ((0.0, 10.0), (20.0, 10.0)), ((0.0, 0.0), (0.0, 10.0))])
+
+def test_corners_not_merged(runTabgen):
+    # A bend of a few degrees is still two lines
+    d = 'M 0,0 L 10,0 L 20,0.5 L 20,10 L 0,10 Z'
+    merged = scoreLines(runTabgen(svgDocument(pathElement('a', d)), OPTIONS + ['--id=a', '--mergescores=true']))
+    assert len(merged) == 5
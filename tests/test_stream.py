@@ -0,0 +1,19 @@
+# Streaming batch mode (--stream) against the usual in-memory run
+import pytest
+
+from conftest import svgDocument, pathElement, MARKER
+
+@pytest.mark.parametrize('mode', ['--scoremode=explode', '--scoremode=dasharray', '--dashlength=0'])
+@pytest.mark.parametrize('layertransform', ['', 'scale(2)', 'translate(3,4) rotate(90) scale(2)'])
+def test_stream_matches_in_memory(runTabgen, mode, layertransform):
+    # With the piece in the current layer, both work in the layer's coordinates, so
+    # the geometry, stroke widths and dash patterns drawn must be the same
+    body = pathElement('a', 'M 0,0 L 30,0 L 30,20 L 0,20 Z', transform='scale(0.8)') +\
+           pathElement('m', 'M 0,0 L 24,0', style=MARKER)
+    options = ['--id=a', '--id=m', '--tabmarker=true', '--unit=mm', '--tabheight=2', '--dashlength=0.5', mode]
+    document = svgDocument(body, layertransform)
+    expected = runTabgen(document, options)
+    streamed = runTabgen(document, options, stream=True)
+    assert sorted(streamed) == sorted(expected)
+    for label in expected:
+        assert streamed[label] == pytest.approx(expected[label], abs=1e-3)
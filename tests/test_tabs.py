@@ -0,0 +1,73 @@
+# Tab geometry: fitting a tab to its edge, and which side of the edge it goes on
+import math
+
+import pytest
+
+import tabgen
+from conftest import svgDocument, pathElement
+
+def topWidth(seglength, height, angle):
+    # Width left at the top of a tab on an edge of seglength
+    if angle >= 90.0:
+        return seglength
+    return seglength - 2.0*height/math.tan(math.radians(angle))
+
+@pytest.mark.parametrize('seglength, tabht, taba, expected', [
+    (10.0, 4.0, 90.0, (4.0, 90.0)), # a rectangle always fits
+    (10.0, 40.0, 90.0, (40.0, 90.0)),
+    (0.0, 2.0, 45.0, (2.0, 45.0)), # nothing fits, so leave it alone
+    (10.0, 2.0, 45.0, (2.0, 45.0)), # already fits
+    (10.0, 1.5, 20.0, (1.5, 20.0)),
+])
+def test_fit_tab_unchanged(seglength, tabht, taba, expected):
+    assert tabgen.Tabgen().fitTab(seglength, tabht, taba) == pytest.approx(expected)
+
+def test_fit_tab_steepens():
+    # Too high for 45 degrees, but a steeper angle keeps the requested height
+    height, angle = tabgen.Tabgen().fitTab(10.0, 6.0, 45.0)
+    assert height == 6.0
+    assert 45.0 < angle <= 88.0
+    assert topWidth(10.0, height, angle) == pytest.approx(0.001*10.0)
+
+def test_fit_tab_lowers():
+    # Would need more than 88 degrees, so the tab is lowered at the requested angle
+    height, angle = tabgen.Tabgen().fitTab(1.0, 100.0, 45.0)
+    assert angle == 45.0
+    assert height == pytest.approx(0.999*math.tan(math.radians(45.0))/2.0)
+    assert topWidth(1.0, height, angle) == pytest.approx(0.001)
+
+@pytest.mark.parametrize('seglength', [0.01, 1.0, 10.0, 1000.0])
+@pytest.mark.parametrize('tabht', [0.001, 0.4, 5.0, 1e6])
+@pytest.mark.parametrize('taba', [1.0, 30.0, 45.0, 60.0, 87.9, 89.9, 90.0])
+def test_fit_tab_sides_never_cross(seglength, tabht, taba):
+    height, angle = tabgen.Tabgen().fitTab(seglength, tabht, taba)
+    assert 0.0 < height <= tabht
+    assert taba <= angle <= max(taba, 88.0)
+    assert topWidth(seglength, height, angle) > 0.0
+
+SQUARE = 'M 0,0 L 20,0 L 20,20 L 0,20 Z'
+
+@pytest.mark.parametrize('d', [
+    SQUARE,
+    'M 0,0 L 0,20 L 20,20 L 20,0 Z', # clockwise
+    'M 0,0 L 20,0 L 20,8 L 8,8 L 8,20 L 0,20 Z', # concave
+    SQUARE + ' M 5,5 L 15,5 L 15,15 L 5,15 Z', # a cutout wound the same way
+    SQUARE + ' M 5,5 L 5,15 L 15,15 L 15,5 Z', # and the other way
+])
+@pytest.mark.parametrize('layertransform', ['', 'matrix(1,0,0,-1,0,100)'])
+def test_winding_matches_probe(runTabgen, d, layertransform):
+    # Both ways of finding the outside of an edge must put every tab on the same side
+    document = svgDocument(pathElement('a', d), layertransform)
+    options = ['--id=a', '--unit=mm', '--tabheight=2', '--dashlength=0']
+    winding = runTabgen(document, options + ['--tabside=winding'])
+    probe = runTabgen(document, options + ['--tabside=probe'])
+    assert sorted(winding) == sorted(probe)
+    for label in probe:
+        assert winding[label] == pytest.approx(probe[label], abs=1e-6)
+
+def test_tabs_go_outside(runTabgen):
+    shapes = runTabgen(svgDocument(pathElement('a', SQUARE)), ['--id=a', '--unit=mm', '--tabheight=2', '--dashlength=0'])
+    coords = shapes['model0'][1:]
+    for x, y in zip(coords[0::2], coords[1::2]):
+        assert not ((0.0 < x < 20.0) and (0.0 < y < 20.0))
+    assert min(coords) == pytest.approx(-2.0) and max(coords) == pytest.approx(22.0)